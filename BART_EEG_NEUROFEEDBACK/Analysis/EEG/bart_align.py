@@ -0,0 +1,90 @@
+"""
+bart_align.py
+
+Marker → EEG sample alignment shared by the P300 notebooks (Multiple XDF / Single XDF).
+
+align_events() maps every marker time to its nearest EEG sample in one np.searchsorted
+pass (O(n_events · log n_samples)) instead of an argmin over the whole recording per event.
+
+With fit_clock=True the EEG timestamps are first replaced by a least-squares line
+t = t0 + k · dt per continuous segment (k = sample index; segments split at gaps), which
+removes LSL timestamp jitter and absorbs drift between the nominal and the actual
+sampling rate. pyxdf.load_xdf already does this by default (dejitter_timestamps=True);
+use it for streams loaded without dejitter, or to check the clock (clock_stats).
+
+In Colab, upload this file to /content next to the .xdf files.
+"""
+
+import numpy as np
+
+GAP_S = 1.0  # timestamp step (s) that starts a new clock segment (recording paused / stream dropout)
+
+
+def _segments(eeg_t, gap_s=GAP_S):
+    """Segment id per sample: a new segment starts after a gap > gap_s or a step backwards."""
+    d = np.diff(eeg_t)
+    return np.concatenate([[0], np.cumsum((d > gap_s) | (d <= 0))])
+
+
+def fit_clock(eeg_t, gap_s=GAP_S):
+    """(fitted timestamps, per-segment dt) from a linear fit of timestamp vs sample index."""
+    t = np.asarray(eeg_t, dtype=float)
+    if t.size < 2:
+        return t.copy(), np.array([np.nan])
+    seg = _segments(t, gap_s)
+    ns = int(seg[-1]) + 1
+    k = np.arange(t.size, dtype=float)
+    n = np.bincount(seg, minlength=ns).astype(float)
+    km = np.bincount(seg, weights=k, minlength=ns) / n
+    tm = np.bincount(seg, weights=t, minlength=ns) / n
+    dk = k - km[seg]
+    sxx = np.bincount(seg, weights=dk * dk, minlength=ns)
+    sxy = np.bincount(seg, weights=dk * (t - tm[seg]), minlength=ns)
+    dt = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0)  # 1-sample segments keep their stamp
+    return tm[seg] + dt[seg] * dk, dt
+
+
+def clock_stats(eeg_t, nominal_srate=None, gap_s=GAP_S):
+    """Fitted sampling rate, jitter (residual SD / max, ms), segment count and drift vs nominal (ppm)."""
+    t = np.asarray(eeg_t, dtype=float)
+    fitted, dt = fit_clock(t, gap_s)
+    resid_ms = (t - fitted) * 1e3
+    good = dt[np.isfinite(dt) & (dt > 0)]
+    srate = float(1.0 / np.median(good)) if good.size else float("nan")
+    out = {
+        "srate_fit": srate,
+        "jitter_ms_sd": float(np.std(resid_ms)) if t.size else float("nan"),
+        "jitter_ms_max": float(np.max(np.abs(resid_ms))) if t.size else float("nan"),
+        "segments": int(len(dt)),
+    }
+    if nominal_srate:
+        out["drift_ppm"] = float((srate / float(nominal_srate) - 1.0) * 1e6)
+    return out
+
+
+def nearest_samples(eeg_t, event_t):
+    """Index of the nearest sample (ties → earlier, as np.argmin) for each event time; eeg_t ascending."""
+    t = np.asarray(eeg_t, dtype=float)
+    ev = np.atleast_1d(np.asarray(event_t, dtype=float))
+    if t.size < 2:
+        return np.zeros(ev.shape, dtype=int)
+    idx = np.clip(np.searchsorted(t, ev), 1, t.size - 1)
+    idx -= (ev - t[idx - 1]) <= (t[idx] - ev)
+    return idx
+
+
+def align_events(eeg_t, event_t, fit=False, gap_s=GAP_S):
+    """Sample index per event time (nearest sample; on the fitted clock when fit=True)."""
+    t = fit_clock(eeg_t, gap_s)[0] if fit else eeg_t
+    return nearest_samples(t, event_t)
+
+
+def outside_recording(eeg_t, event_t, tol_s=None):
+    """Mask of events before the first / after the last EEG sample (± tol_s, default one median sample)."""
+    t = np.asarray(eeg_t, dtype=float)
+    ev = np.atleast_1d(np.asarray(event_t, dtype=float))
+    if t.size == 0:
+        return np.ones(ev.shape, dtype=bool)
+    if tol_s is None:
+        tol_s = float(np.median(np.diff(t))) if t.size > 1 else 0.0
+    return (ev < t[0] - tol_s) | (ev > t[-1] + tol_s)
@@ -0,0 +1,538 @@
+"""
+p300_batch.py
+
+Explosion-locked P300 pipeline for many XDF files (the per-file body of
+Multiple XDF/BART_P300_Analysis.ipynb), fanned out over a process pool.
+
+Each file is independent and CPU-bound (pyxdf decode → MNE Raw → epochs →
+features), so files run in parallel worker processes. Only the EEG and marker
+streams are decoded (picked from the stream headers first), and the P300
+features are computed for all epochs at once (p300_feature_arrays). Results are
+merged in input-file order (then event order), so the output does not depend on
+which worker finishes first. A file that fails is reported in the status table
+and does not abort the run.
+
+Usage:
+    python p300_batch.py /data/xdf/*.xdf -o results/ -j 32
+    python p300_batch.py /data/xdf/ --journal-dir /data/bids -j 8
+
+Writes p300_explosions.csv / .xlsx, p300_session_summary.csv and
+p300_batch_status.csv to the output folder. Decoded XDFs are cached (xdf_cache.py,
+default <xdf folder>/.xdf_cache), so re-running with other P300 settings skips
+the decode.
+
+The notebook imports this module (import p300_batch as pb); in Colab, upload it
+to /content together with bart_events.py, bart_align.py and xdf_cache.py.
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import mne
+
+# Sibling modules (bart_align, xdf_cache) and, in the repo layout, Task/bart_events.py.
+# In Colab the module sits in /content, which has no Task folder two levels up.
+_here = Path(__file__).resolve()
+_task_dir = _here.parents[2] / "Task" if len(_here.parents) > 2 else None
+sys.path.insert(0, str(_here.parent))
+if _task_dir is not None and _task_dir.is_dir():
+    sys.path.append(str(_task_dir))
+
+try:
+    import bart_events as be  # shared marker registry (numeric markers, task journal)
+except ImportError:
+    be = None
+    print("⚠️ bart_events.py not found: string markers only (no BART_MarkersNum / marker journal).")
+import bart_align as ba
+import xdf_cache as xc
+
+mne.set_log_level("WARNING")
+
+# ----------------------------------------------------------------------
+# CONFIG (same names and defaults as the notebook's USER CONFIG cell)
+# ----------------------------------------------------------------------
+
+ACTICAP_16_CH_NAMES = [
+    "Fz", "Cz", "Pz", "POz",
+    "Fp1", "Fp2", "F3", "F4",
+    "FCz", "C3", "C4", "CPz",
+    "P3", "P4", "O1", "O2",
+]
+
+DEFAULT_CONFIG = {
+    "EEG_STREAM_NAME_CANDIDATES": ["openvibeSignal", "EEG", "ActiCAP", "BrainVision"],
+    "MARKER_STREAM_NAME": be.MARKER_STREAM_NAME if be else "BART_Markers",
+    "NUMERIC_MARKER_STREAM_NAME": be.NUMERIC_MARKER_STREAM_NAME if be else "BART_MarkersNum",
+    "FIT_CLOCK": False,
+    "TMIN": -0.200,
+    "TMAX": 0.800,
+    "BASELINE": (-0.200, 0.0),
+    "P300_WIN": (0.250, 0.500),
+    "P300_MEAN_WIN": (0.300, 0.450),
+    "P300_FRAC_AREA": 0.5,   # fractional-area latency: share of the positive area in P300_WIN
+    "ACTICAP_16_CH_NAMES": ACTICAP_16_CH_NAMES,
+    "P300_CHANNEL_PREFERENCE": ["Pz", "CPz", "POz", "Cz", "P3", "P4"],
+    "P300_ROI": ["Pz", "CPz", "P3", "P4", "POz"],
+    "REJECT_UV": 120.0,
+    "JOURNAL_DIRS": ["/content"],
+    "XDF_CACHE": True,       # decode each XDF once (xdf_cache.py); False = pyxdf.load_xdf every run
+    "XDF_CACHE_DIR": None,   # None = <xdf folder>/.xdf_cache
+}
+
+STATUS_COLUMNS = ("file", "status", "n_rows", "seconds", "message")
+
+# Keys of p300_feature_arrays() (ROI-average versions are prefixed "roi_")
+P300_FEATURES = ("peak_amp_V", "peak_lat_s", "mean_amp_V", "frac_lat_s")
+
+
+def make_config(**overrides):
+    """DEFAULT_CONFIG with overrides (unknown keys are an error, to catch typos)."""
+    unknown = set(overrides) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise KeyError(f"Unknown P300 config keys: {sorted(unknown)}")
+    return {**DEFAULT_CONFIG, **overrides}
+
+
+# ----------------------------------------------------------------------
+# HELPERS
+# ----------------------------------------------------------------------
+
+def parse_bids_from_xdf_filename(xdf_path):
+    # Parse sub/ses/run/task if filename is BIDS-like:
+    # sub-P001_ses-S032_task-Default_run-001_eeg.xdf
+    name = Path(xdf_path).name
+    out = {"sub": None, "ses": None, "run": None, "task": None, "file": name}
+    for k in ("sub", "ses", "run", "task"):
+        m = re.search(k + r"-([A-Za-z0-9]+)", name)
+        if m:
+            out[k] = m.group(1)
+    return out
+
+
+def _info(s):
+    """Stream header: the 'info' of a decoded pyxdf stream, or a pyxdf.resolve_streams dict as is."""
+    return s["info"] if "info" in s else s
+
+
+def find_stream(streams, want_name=None, want_type=None):
+    # streams: decoded pyxdf streams or header-only stream infos (xc.stream_infos)
+    for s in streams:
+        info = _info(s)
+        name = xc.info_value(info, "name")
+        stype = xc.info_value(info, "type")
+        if want_name is not None and name == want_name:
+            return s
+        if want_type is not None and stype == want_type:
+            return s
+    return None
+
+
+def find_eeg_stream(streams, candidates=DEFAULT_CONFIG["EEG_STREAM_NAME_CANDIDATES"]):
+    for nm in candidates:
+        s = find_stream(streams, want_name=nm)
+        if s is not None:
+            return s
+    s = find_stream(streams, want_type="EEG")
+    if s is not None:
+        return s
+    # fallback: the numeric stream with the most channels (header channel_count, no data access)
+    best, best_n = None, -1
+    for s in streams:
+        info = _info(s)
+        n = xc.channel_count(info)
+        if xc.info_value(info, "channel_format") != "string" and n >= 4 and n > best_n:
+            best, best_n = s, n
+    return best
+
+
+def parse_marker_strings(marker_stream):
+    msgs = marker_stream["time_series"]
+    ts = marker_stream["time_stamps"]
+    out = []
+    for t, m in zip(ts, msgs):
+        if isinstance(m, (list, tuple, np.ndarray)):
+            m = m[0] if len(m) else ""
+        if isinstance(m, bytes):
+            m = m.decode("utf-8", errors="ignore")
+        out.append((float(t), str(m)))
+    return out
+
+
+def _marker_fields(msg):
+    """{key: value} from a "CODE;key=value;..." marker string (bart_events.parse_marker_string when available)."""
+    if be is not None:
+        return be.parse_marker_string(msg)[1]
+    return dict(p.split("=", 1) for p in str(msg).split(";")[1:] if "=" in p)
+
+
+def eeg_channel_names(eeg_stream, n_ch, default_16=ACTICAP_16_CH_NAMES):
+    """Channel labels from the stream header; ActiCAP map for 16 unlabeled channels; else Ch1.."""
+    try:
+        desc = eeg_stream["info"]["desc"][0]
+        if "channels" in desc and "channel" in desc["channels"][0]:
+            labels = [c["label"][0] for c in desc["channels"][0]["channel"] if "label" in c and len(c["label"])]
+            if len(labels) == n_ch:
+                return labels, "header"
+    except Exception:
+        pass
+    if n_ch == 16:
+        return list(default_16), "acticap16"
+    return [f"Ch{i+1}" for i in range(n_ch)], "generic"
+
+
+def compute_p300_features(epoch_1d, sfreq, cfg=DEFAULT_CONFIG):
+    '''
+    epoch_1d: (n_times,) in Volts, starting at TMIN
+
+    Returns:
+      peak_amp_V, peak_lat_s, mean_amp_V
+
+    Single-epoch view of p300_feature_arrays (peak within P300_WIN, mean within P300_MEAN_WIN).
+    '''
+    x = np.asarray(epoch_1d, dtype=float)
+    f = p300_feature_arrays(x[None, None, :], np.arange(x.size) / sfreq + cfg["TMIN"], cfg)
+    return float(f["peak_amp_V"][0, 0]), float(f["peak_lat_s"][0, 0]), float(f["mean_amp_V"][0, 0])
+
+
+def window_slice(times, win):
+    """Index slice of the samples with win[0] <= t <= win[1] (times ascending)."""
+    return slice(int(np.searchsorted(times, win[0], "left")), int(np.searchsorted(times, win[1], "right")))
+
+
+def p300_feature_arrays(data, times, cfg=DEFAULT_CONFIG, roi_idx=None):
+    '''
+    Batched P300 features for all epochs and channels at once.
+
+    data: (n_epochs, n_channels, n_times) in Volts (epochs.get_data())
+    times: (n_times,) epoch time axis in s (epochs.times)
+    roi_idx: channel indices averaged into an ROI waveform (None = no ROI)
+
+    Returns a dict of (n_epochs, n_channels) arrays (P300_FEATURES):
+      peak_amp_V, peak_lat_s   max within P300_WIN and its latency
+      mean_amp_V               average within P300_MEAN_WIN
+      frac_lat_s               time at which the positive area within P300_WIN
+                               reaches P300_FRAC_AREA of its total
+    plus roi_<feature> (n_epochs,) arrays for the ROI waveform when roi_idx is given.
+    Empty windows (and windows without positive area, for frac_lat_s) → NaN.
+    '''
+    x = np.asarray(data, dtype=float)
+    times = np.asarray(times, dtype=float)
+    if roi_idx is not None:
+        x = np.concatenate([x, x[:, list(roi_idx), :].mean(axis=1, keepdims=True)], axis=1)
+
+    nan = np.full(x.shape[:2], np.nan)
+    peak_sl = window_slice(times, cfg["P300_WIN"])
+    mean_sl = window_slice(times, cfg["P300_MEAN_WIN"])
+
+    # --- peak + fractional-area latency within P300_WIN ---
+    seg = x[..., peak_sl]
+    if seg.shape[-1]:
+        t_win = times[peak_sl]
+        i_peak = seg.argmax(axis=-1)
+        peak_amp = np.take_along_axis(seg, i_peak[..., None], axis=-1)[..., 0]
+        peak_lat = t_win[i_peak]
+        area = np.cumsum(np.clip(seg, 0.0, None), axis=-1)
+        total = area[..., -1]
+        i_frac = (area >= cfg["P300_FRAC_AREA"] * total[..., None]).argmax(axis=-1)
+        frac_lat = np.where(total > 0, t_win[i_frac], np.nan)
+    else:
+        peak_amp, peak_lat, frac_lat = nan, nan, nan
+
+    # --- mean within P300_MEAN_WIN ---
+    mean_amp = x[..., mean_sl].mean(axis=-1) if mean_sl.stop > mean_sl.start else nan
+
+    out = dict(zip(P300_FEATURES, (peak_amp, peak_lat, mean_amp, frac_lat)))
+    if roi_idx is not None:
+        out = {**{k: v[:, :-1] for k, v in out.items()}, **{"roi_" + k: v[:, -1] for k, v in out.items()}}
+    return out
+
+
+# ----------------------------------------------------------------------
+# ONE FILE
+# ----------------------------------------------------------------------
+
+def process_xdf(xdf_path, cfg=DEFAULT_CONFIG):
+    """Per-explosion P300 rows for one XDF → DataFrame (empty when the file has nothing to epoch)."""
+    bids = parse_bids_from_xdf_filename(xdf_path)
+    print("\n=== Loading:", xdf_path, "===")
+
+    # Pick the EEG / marker streams from the stream headers, then decode (or memory-map) only those
+    infos = xc.stream_infos(xdf_path, use_cache=cfg["XDF_CACHE"], cache_dir=cfg["XDF_CACHE_DIR"])
+    wanted = [find_eeg_stream(infos, cfg["EEG_STREAM_NAME_CANDIDATES"]),
+              find_stream(infos, want_name=cfg["MARKER_STREAM_NAME"]),
+              find_stream(infos, want_name=cfg["NUMERIC_MARKER_STREAM_NAME"])]
+    if wanted[0] is None:
+        print("⚠️ No EEG stream found. Skipping.")
+        return pd.DataFrame()
+    stream_ids = sorted({info["stream_id"] for info in wanted if info is not None})
+    streams, header = xc.load_streams(xdf_path, stream_ids, use_cache=cfg["XDF_CACHE"], cache_dir=cfg["XDF_CACHE_DIR"])
+
+    eeg_stream = find_eeg_stream(streams, cfg["EEG_STREAM_NAME_CANDIDATES"])
+    marker_stream = find_stream(streams, want_name=cfg["MARKER_STREAM_NAME"])
+    num_marker_stream = find_stream(streams, want_name=cfg["NUMERIC_MARKER_STREAM_NAME"])
+    if be is None:
+        num_marker_stream = None  # decoding the numeric schema needs bart_events
+
+    if marker_stream is None and num_marker_stream is None and be is not None:
+        # Recovery: the task also journals every marker to <stem>_markers.jsonl in its BIDS folder
+        journal = be.find_marker_journal(xdf_path, search_dirs=cfg["JOURNAL_DIRS"])
+        if journal is not None:
+            print("ℹ️ Marker streams missing from XDF; using task journal:", journal)
+            marker_stream, num_marker_stream = be.load_marker_journal(journal)
+
+    if eeg_stream is None:
+        print("⚠️ No EEG stream found. Skipping.")
+        return pd.DataFrame()
+    if marker_stream is None and num_marker_stream is None:
+        print("⚠️ No BART_Markers / BART_MarkersNum stream found. Skipping.")
+        return pd.DataFrame()
+
+    eeg = np.asarray(eeg_stream["time_series"])
+    eeg_t = np.asarray(eeg_stream["time_stamps"])
+    sfreq = float(eeg_stream["info"].get("nominal_srate", [0])[0] or 0)
+
+    if not sfreq or sfreq <= 0:
+        sfreq = 1.0 / np.median(np.diff(eeg_t))
+
+    print("EEG shape:", eeg.shape, "sfreq~", sfreq)
+
+    ch_names, ch_source = eeg_channel_names(eeg_stream, eeg.shape[1], cfg["ACTICAP_16_CH_NAMES"])
+    if ch_source == "acticap16":
+        print("✅ Applied ActiCAP 16-channel label map.")
+    elif ch_source == "generic":
+        print("⚠️ No channel labels; using Ch1..")
+
+    data = eeg.T.astype(float)  # (n_ch, n_times)
+
+    # Heuristic: if values look like µV, convert to V
+    if np.median(np.abs(data)) > 1e-3:
+        data = data * 1e-6
+
+    info = mne.create_info(ch_names=ch_names, sfreq=sfreq, ch_types="eeg")
+    raw = mne.io.RawArray(data, info, verbose="ERROR")
+
+    # explode = [(lsl_time, meta_dict), ...]
+    if num_marker_stream is not None:
+        m_t, m_tab = be.numeric_markers(num_marker_stream)
+        sel = np.flatnonzero(m_tab["event"] == be.EVENT_CODES["BART_EXPLODE"])
+        explode = [(float(m_t[k]), be.marker_meta(m_tab, k)) for k in sel]
+    else:
+        markers = parse_marker_strings(marker_stream)
+        explode = [(t, _marker_fields(msg)) for (t, msg) in markers if msg.startswith("BART_EXPLODE")]
+    print("Explosions found:", len(explode))
+    if len(explode) == 0:
+        return pd.DataFrame()
+
+    explode_t = np.array([t for (t, _) in explode])
+    event_samps = ba.align_events(eeg_t, explode_t, fit=cfg["FIT_CLOCK"])  # one searchsorted pass
+    n_out = int(ba.outside_recording(eeg_t, explode_t).sum())
+    if n_out:
+        print(f"⚠️ {n_out} explosion(s) fall outside the EEG recording (aligned to its first/last sample).")
+    if cfg["FIT_CLOCK"]:
+        print("Clock:", ba.clock_stats(eeg_t, sfreq))
+    events = np.column_stack([event_samps, np.zeros(len(event_samps), dtype=int), np.ones(len(event_samps), dtype=int)])
+
+    reject = None if cfg["REJECT_UV"] is None else dict(eeg=cfg["REJECT_UV"] * 1e-6)
+    epochs = mne.Epochs(raw, events, event_id={"explode": 1},
+                        tmin=cfg["TMIN"], tmax=cfg["TMAX"], baseline=cfg["BASELINE"],
+                        reject=reject, preload=True, verbose="ERROR")
+
+    available = set(epochs.ch_names)
+    pick = next((ch for ch in cfg["P300_CHANNEL_PREFERENCE"] if ch in available), None)
+    roi = [ch for ch in cfg["P300_ROI"] if ch in available]
+    use_roi = (pick is None and len(roi) > 0)
+
+    if pick is None and not use_roi:
+        pick = "Cz" if "Cz" in available else epochs.ch_names[0]
+        print("⚠️ Using fallback channel:", pick)
+
+    # All kept epochs at once (n_epochs, n_channels, n_times); channel indices looked up once
+    if use_roi:
+        feats = p300_feature_arrays(epochs.get_data(), epochs.times, cfg,
+                                    roi_idx=[epochs.ch_names.index(ch) for ch in roi])
+        f = {k: feats["roi_" + k] for k in P300_FEATURES}
+        ch_used = "ROI:" + ",".join(roi)
+    else:
+        c = epochs.ch_names.index(pick)
+        feats = p300_feature_arrays(epochs.get_data()[:, c:c + 1, :], epochs.times, cfg)
+        f = {k: v[:, 0] for k, v in feats.items()}
+        ch_used = pick
+
+    # epochs.selection maps kept epochs back to explode[] (rejected epochs are skipped)
+    sel = np.asarray(epochs.selection, dtype=int)
+    metas = [explode[i][1] for i in sel]
+    return pd.DataFrame({
+        **{k: [v] * len(sel) for k, v in bids.items()},
+        "event_index": sel,
+        "event_time_lsl": explode_t[sel],
+        "event_sample": np.asarray(event_samps)[sel].astype(int),
+        "channel_used": [ch_used] * len(sel),
+        "p300_peak_amp_V": f["peak_amp_V"],
+        "p300_peak_amp_uV": f["peak_amp_V"] * 1e6,
+        "p300_peak_lat_s": f["peak_lat_s"],
+        "p300_mean_amp_V": f["mean_amp_V"],
+        "p300_mean_amp_uV": f["mean_amp_V"] * 1e6,
+        "p300_frac_lat_s": f["frac_lat_s"],
+        **{k: [m.get(k, "") for m in metas] for k in ("block", "trial", "pump", "loss", "total")},
+    })
+
+
+def _run_one(xdf_path, cfg):
+    """Worker entry: (DataFrame or None, status dict, captured log). Never raises."""
+    buf = io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        with redirect_stdout(buf):
+            df = process_xdf(xdf_path, cfg)
+        status = "ok" if len(df) else "skipped"
+        warnings = [ln for ln in buf.getvalue().splitlines() if ln.startswith("⚠️")]
+        message = warnings[-1].lstrip("⚠️ ") if status == "skipped" and warnings else ""
+    except Exception as e:
+        df = None
+        status = "failed"
+        message = f"{type(e).__name__}: {e}"
+        buf.write(traceback.format_exc())
+    return df, {
+        "file": Path(xdf_path).name,
+        "status": status,
+        "n_rows": 0 if df is None else len(df),
+        "seconds": round(time.perf_counter() - t0, 2),
+        "message": message,
+    }, buf.getvalue()
+
+
+# ----------------------------------------------------------------------
+# MANY FILES
+# ----------------------------------------------------------------------
+
+def run_batch(xdf_files, cfg=DEFAULT_CONFIG, workers=None, verbose=True):
+    """
+    Process xdf_files over `workers` processes (None = all cores, 1 = in this process).
+
+    Returns (p300_df, status_df): rows concatenated in xdf_files order, and one
+    status row per file (ok / skipped / failed + message).
+    """
+    xdf_files = [str(p) for p in xdf_files]
+    n = len(xdf_files)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(int(workers), n or 1))
+
+    results = [None] * n
+
+    def _report(k, res):
+        results[k] = res
+        if verbose:
+            print(res[2], end="")
+            st = res[1]
+            print(f"[{sum(r is not None for r in results)}/{n}] {st['file']}: {st['status']} "
+                  f"({st['n_rows']} rows, {st['seconds']:.1f} s){' — ' + st['message'] if st['message'] else ''}")
+
+    if workers == 1:
+        for k, path in enumerate(xdf_files):
+            _report(k, _run_one(path, cfg))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(_run_one, path, cfg): k for k, path in enumerate(xdf_files)}
+            for fut in as_completed(futures):
+                k = futures[fut]
+                try:
+                    res = fut.result()
+                except Exception as e:  # worker process died (e.g. out of memory)
+                    res = (None, {"file": Path(xdf_files[k]).name, "status": "failed", "n_rows": 0,
+                                  "seconds": float("nan"), "message": f"{type(e).__name__}: {e}"}, "")
+                _report(k, res)
+
+    frames = [r[0] for r in results if r[0] is not None and len(r[0])]
+    p300_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    status_df = pd.DataFrame([r[1] for r in results], columns=list(STATUS_COLUMNS))
+    return p300_df, status_df
+
+
+def session_summary(p300_df):
+    """Per-session P300 summary (for plotting across sessions)."""
+    if len(p300_df) == 0:
+        return pd.DataFrame()
+    return (p300_df
+            .groupby(["sub", "ses", "run", "task"], dropna=False)
+            .agg(
+                n_explosions=("p300_peak_amp_uV", "size"),
+                p300_peak_amp_uV_mean=("p300_peak_amp_uV", "mean"),
+                p300_peak_amp_uV_median=("p300_peak_amp_uV", "median"),
+                p300_mean_amp_uV_mean=("p300_mean_amp_uV", "mean"),
+                p300_mean_amp_uV_median=("p300_mean_amp_uV", "median"),
+                p300_peak_lat_ms_mean=("p300_peak_lat_s", lambda x: np.nanmean(x) * 1000.0),
+                p300_peak_lat_ms_median=("p300_peak_lat_s", lambda x: np.nanmedian(x) * 1000.0),
+                p300_frac_lat_ms_mean=("p300_frac_lat_s", lambda x: np.nanmean(x) * 1000.0),
+                p300_frac_lat_ms_median=("p300_frac_lat_s", lambda x: np.nanmedian(x) * 1000.0),
+                file=("file", "first"),
+                channel_used=("channel_used", "first")
+            )
+            .reset_index())
+
+
+# ----------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------
+
+def _expand(paths):
+    out = []
+    for p in map(Path, paths):
+        out.extend(sorted(p.rglob("*.xdf")) if p.is_dir() else [p])
+    return sorted({str(p) for p in out})
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Explosion-locked P300 features for many XDF files (parallel).")
+    ap.add_argument("paths", nargs="+", help=".xdf files and/or folders (searched recursively)")
+    ap.add_argument("-o", "--out-dir", default=".", help="output folder (default: current folder)")
+    ap.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores; 1 = serial)")
+    ap.add_argument("--journal-dir", action="append", default=[],
+                    help="folder searched for <stem>_markers.jsonl when an XDF lacks marker streams (repeatable)")
+    ap.add_argument("--fit-clock", action="store_true", help="align markers on a linear fit of the EEG clock")
+    ap.add_argument("--cache-dir", default=None, help="decoded-XDF cache folder (default: <xdf folder>/.xdf_cache)")
+    ap.add_argument("--no-cache", action="store_true", help="always decode the XDF files (no cache)")
+    ap.add_argument("--no-xlsx", action="store_true", help="skip p300_explosions.xlsx")
+    ap.add_argument("-q", "--quiet", action="store_true", help="only print the final status table")
+    args = ap.parse_args(argv)
+
+    xdf_files = _expand(args.paths)
+    if not xdf_files:
+        ap.error("no .xdf files found")
+
+    cfg = make_config(FIT_CLOCK=args.fit_clock, JOURNAL_DIRS=args.journal_dir or DEFAULT_CONFIG["JOURNAL_DIRS"],
+                      XDF_CACHE=not args.no_cache, XDF_CACHE_DIR=args.cache_dir)
+    t0 = time.perf_counter()
+    p300_df, status_df = run_batch(xdf_files, cfg, workers=args.workers, verbose=not args.quiet)
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    p300_df.to_csv(out_dir / "p300_explosions.csv", index=False)
+    if not args.no_xlsx:
+        with pd.ExcelWriter(out_dir / "p300_explosions.xlsx", engine="openpyxl") as w:
+            p300_df.to_excel(w, sheet_name="explosions", index=False)
+    session_summary(p300_df).to_csv(out_dir / "p300_session_summary.csv", index=False)
+    status_df.to_csv(out_dir / "p300_batch_status.csv", index=False)
+
+    counts = status_df["status"].value_counts().to_dict()
+    print(f"\n{len(xdf_files)} files in {time.perf_counter() - t0:.1f} s: "
+          + ", ".join(f"{counts.get(s, 0)} {s}" for s in ("ok", "skipped", "failed")))
+    failed = status_df[status_df["status"] == "failed"]
+    for _, r in failed.iterrows():
+        print(f"  ✗ {r['file']}: {r['message']}")
+    print("Saved to:", out_dir.resolve())
+    return 1 if len(failed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
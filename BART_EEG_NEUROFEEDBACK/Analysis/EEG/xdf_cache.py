@@ -0,0 +1,262 @@
+"""
+xdf_cache.py
+
+Selective, decode-once loading of LabRecorder .xdf files, shared by the P300 notebooks
+and p300_batch.py.
+
+Selective: stream_infos() lists the streams from their headers only
+(pyxdf.resolve_streams: name, type, channel_count, channel_format, ...), so callers
+pick the EEG / marker streams without decoding anything; load_streams() then passes
+select_streams to pyxdf.load_xdf so only those streams are decoded.
+
+Decode-once: with a cache folder, each decoded stream is written to
+<cache_dir>/<key>/:
+    header.json       file header, stream header infos, per-stream info/footer
+    s<id>_time.npy    time stamps  (float64)
+    s<id>_data.npy    time series  (numeric streams: samples × channels;
+                                    string streams: fixed-width unicode)
+where <key> is the SHA-1 of the file contents plus the load_xdf options (dejitter
+etc. change the decoded result). Later loads read header.json and np.load the
+arrays with mmap_mode="r": only the requested streams are opened, and only the
+pages actually touched are read from disk. Streams not cached yet are decoded
+(and added to the entry) on first request.
+
+Write protocol (entries are updated in place, stream by stream):
+1. each new stream's .npy files are written to a temp name and os.replace'd
+2. header.json, listing the streams, is rewritten last via temp file + os.replace
+header.json is the only index: a stream whose arrays exist but that is not listed
+there (crash or kill mid-update) is ignored and decoded again on the next load.
+
+Streams come back as pyxdf-style dicts ({"info", "footer", "time_series",
+"time_stamps"}); string streams are returned as list-of-lists, like pyxdf.
+
+The SHA-1 of each source file is remembered per path/size/mtime under
+<cache_dir>/by_path/, so an unchanged file is not re-hashed on every load.
+
+In Colab, upload this file to /content next to the .xdf files.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+CACHE_VERSION = 2
+CACHE_DIRNAME = ".xdf_cache"  # default: next to the .xdf
+
+
+def default_cache_dir(xdf_path):
+    return Path(xdf_path).resolve().parent / CACHE_DIRNAME
+
+
+def _json_default(o):
+    if isinstance(o, np.ndarray) or isinstance(o, np.generic):
+        return o.tolist()
+    if isinstance(o, (set, tuple)):
+        return list(o)
+    return str(o)
+
+
+def _write_json(path, obj):
+    """Atomic JSON write: temp file in the same folder, fsync, os.replace."""
+    tmp = Path(str(path) + f".tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, default=_json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _save_npy(path, arr):
+    tmp = Path(str(path) + f".tmp{os.getpid()}.npy")
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def file_sha1(xdf_path, cache_dir=None, chunk=1 << 20):
+    """SHA-1 of the file contents (memoised per absolute path + size + mtime_ns)."""
+    p = Path(xdf_path).resolve()
+    st = p.stat()
+    memo = None
+    if cache_dir is not None:
+        memo = Path(cache_dir) / "by_path" / (hashlib.sha1(str(p).encode("utf-8")).hexdigest() + ".json")
+        try:
+            with open(memo, encoding="utf-8") as f:
+                m = json.load(f)
+            if m.get("size") == st.st_size and m.get("mtime_ns") == st.st_mtime_ns:
+                return m["sha1"]
+        except (OSError, ValueError, KeyError):
+            pass
+    h = hashlib.sha1()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    if memo is not None:
+        try:
+            memo.parent.mkdir(parents=True, exist_ok=True)
+            _write_json(memo, {"path": str(p), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest})
+        except OSError:
+            pass
+    return digest
+
+
+def cache_key(sha1, load_kwargs=None):
+    opts = json.dumps(load_kwargs or {}, sort_keys=True, default=_json_default)
+    return f"{sha1}_{hashlib.sha1(opts.encode('utf-8')).hexdigest()[:8]}"
+
+
+def entry_dir_for(xdf_path, cache_dir=None, load_kwargs=None):
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir(xdf_path)
+    return cache_dir / cache_key(file_sha1(xdf_path, cache_dir), load_kwargs)
+
+
+# ----------------------------------------------------------------------
+# STREAM HEADERS (no sample decoding)
+# ----------------------------------------------------------------------
+
+def info_value(info, key, default=""):
+    """Header field from either a resolve_streams dict (flat) or a decoded pyxdf info (list-wrapped)."""
+    v = info.get(key, default)
+    if isinstance(v, list):
+        v = v[0] if v else default
+    return default if v is None else v
+
+
+def channel_count(info):
+    try:
+        return int(info_value(info, "channel_count", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _read_entry(entry_dir):
+    try:
+        with open(Path(entry_dir) / "header.json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == CACHE_VERSION else None
+
+
+def _new_entry(xdf_path, load_kwargs):
+    import pyxdf
+    return {
+        "version": CACHE_VERSION,
+        "source": str(Path(xdf_path).resolve()),
+        "load_kwargs": load_kwargs or {},
+        "header": None,
+        "stream_infos": pyxdf.resolve_streams(str(xdf_path)),
+        "streams": {},
+    }
+
+
+def stream_infos(xdf_path, use_cache=True, cache_dir=None, **load_kwargs):
+    """
+    Header info per stream (pyxdf.resolve_streams dicts: stream_id, name, type,
+    channel_count, channel_format, nominal_srate, ...) without decoding samples.
+    With use_cache the list is stored in the cache entry, so later calls do not parse the file.
+    """
+    if not use_cache:
+        import pyxdf
+        return pyxdf.resolve_streams(str(xdf_path))
+    entry_dir = entry_dir_for(xdf_path, cache_dir, load_kwargs)
+    meta = _read_entry(entry_dir)
+    if meta is None:
+        meta = _new_entry(xdf_path, load_kwargs)
+        try:
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            _write_json(entry_dir / "header.json", meta)
+        except OSError as e:
+            print("⚠️ Could not write XDF cache:", e)
+    return meta["stream_infos"]
+
+
+# ----------------------------------------------------------------------
+# STREAM DATA
+# ----------------------------------------------------------------------
+
+def _stream_arrays(stream):
+    """(data array, time array, is_string) ready for np.save."""
+    t = np.asarray(stream.get("time_stamps", []), dtype=float)
+    ts = stream.get("time_series", [])
+    if isinstance(ts, np.ndarray) and ts.dtype != object:
+        return ts, t, False
+    if len(ts) == 0:
+        fmt = info_value(stream["info"], "channel_format")
+        return np.zeros((0, 1), dtype=str if fmt == "string" else float), t, fmt == "string"
+    return np.asarray([[str(v) for v in row] for row in ts], dtype=str), t, True
+
+
+def _open_stream(entry_dir, m, mmap_mode):
+    data = np.load(entry_dir / m["data"], mmap_mode=None if m["string"] else mmap_mode)
+    return {
+        "info": m["info"],
+        "footer": m["footer"],
+        "time_series": data.tolist() if m["string"] else data,
+        "time_stamps": np.load(entry_dir / m["time"], mmap_mode=mmap_mode),
+    }
+
+
+def load_xdf_cached(xdf_path, stream_ids=None, cache_dir=None, mmap_mode="r", verbose=True, **load_kwargs):
+    """
+    pyxdf.load_xdf with a decode-once cache → (streams, header).
+
+    stream_ids: XDF stream ids to return (None = all). Streams already in the cache are
+    memory-mapped; the others are decoded with select_streams and added to the entry
+    (arrays first, then header.json via temp file + os.replace; see module docstring).
+    load_kwargs are passed to pyxdf.load_xdf (and are part of the cache key).
+    """
+    entry_dir = entry_dir_for(xdf_path, cache_dir, load_kwargs)
+    meta = _read_entry(entry_dir) or _new_entry(xdf_path, load_kwargs)
+    wanted = [s["stream_id"] for s in meta["stream_infos"]] if stream_ids is None else list(stream_ids)
+    missing = sorted(sid for sid in wanted if str(sid) not in meta["streams"])
+
+    if missing:
+        import pyxdf
+        streams, header = pyxdf.load_xdf(str(xdf_path), select_streams=missing, **load_kwargs)
+        added = {}
+        try:
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            for k, s in enumerate(streams):
+                sid = s["info"].get("stream_id", missing[k] if len(streams) == len(missing) else k)
+                data, t, is_string = _stream_arrays(s)
+                _save_npy(entry_dir / f"s{sid}_data.npy", data)
+                _save_npy(entry_dir / f"s{sid}_time.npy", t)
+                added[str(sid)] = {
+                    "info": s.get("info", {}),
+                    "footer": s.get("footer", {}),
+                    "data": f"s{sid}_data.npy",
+                    "time": f"s{sid}_time.npy",
+                    "string": is_string,
+                    "shape": list(data.shape),
+                }
+            # Index last, merged with whatever another process listed meanwhile
+            meta = _read_entry(entry_dir) or meta
+            meta["streams"].update(added)
+            meta["header"] = header
+            _write_json(entry_dir / "header.json", meta)
+            if verbose:
+                print(f"XDF cached {len(streams)} stream(s):", entry_dir)
+        except OSError as e:
+            print("⚠️ Could not write XDF cache:", e)
+            keep = set(wanted) - set(missing)
+            cached = [_open_stream(entry_dir, meta["streams"][str(sid)], mmap_mode) for sid in sorted(keep)]
+            return cached + list(streams), header
+    elif verbose:
+        print("XDF cache hit:", entry_dir)
+
+    return [_open_stream(entry_dir, meta["streams"][str(sid)], mmap_mode)
+            for sid in wanted if str(sid) in meta["streams"]], meta["header"]
+
+
+def load_streams(xdf_path, stream_ids=None, use_cache=True, cache_dir=None, **load_kwargs):
+    """(streams, header) for the given stream ids: through the cache, or pyxdf select_streams directly."""
+    if use_cache:
+        return load_xdf_cached(xdf_path, stream_ids, cache_dir=cache_dir, **load_kwargs)
+    import pyxdf
+    if stream_ids is not None:
+        load_kwargs["select_streams"] = list(stream_ids)
+    return pyxdf.load_xdf(str(xdf_path), **load_kwargs)
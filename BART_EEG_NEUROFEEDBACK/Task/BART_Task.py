@@ -13,6 +13,96 @@ from psychopy import visual, event, core, sound  # Import dependency
 from psychopy.hardware import keyboard  # Import dependency
 import random, csv, os, time, json, numpy as np  # Import dependency
 import re  # Regex for BIDS/manifest parsing
+import threading  # Background NF acquisition
+import queue  # Background trial-row writer
+from bart_beh import sidecar_path, write_sidecar, load_sidecar, widen_rows, wide_fieldnames, REST_STATS  # Session sidecar + wide export (Task/bart_beh.py)
+from bart_beh import parquet_path, write_parquet, nf_sample_rows, TRIAL_TYPES, PUMP_TYPES, NF_SAMPLE_TYPES  # Columnar output
+from bart_beh import PumpEventLog, pump_event_rows, PUMP_COLUMNS  # Per-pump event table
+from bart_summary import summarize, summary_rows, SUMMARY_COLUMNS  # Vectorised per-block summary (Task/bart_summary.py)
+from bart_events import MARKER_STREAM_NAME, NUMERIC_MARKER_STREAM_NAME, MARKER_CHANNELS, encode_marker  # Shared marker registry (Task/bart_events.py)
+
+# ----------------------------------------------------------------------
+# STARTUP TIMING + BACKGROUND INIT
+# NOTE: With FAST_START the slow, window-independent setup runs on daemon threads: the
+# audio backend for the rest chime while the operator types the IDs, and (NF sessions only,
+# once the manifest has fixed the mode) LSL stream resolution while the stimuli are built.
+# The main thread waits a bounded time for a result and otherwise does the work itself.
+# ----------------------------------------------------------------------
+
+class StartupTimer:
+    """Wall-clock duration of each startup phase (main thread) and of each background job."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._last = self.t0
+        self.phases = []       # (phase, seconds) in order, main thread
+        self.background = []   # (job, seconds), appended by the job threads
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def as_dict(self):
+        return {
+            "phases": {k: round(v, 3) for k, v in self.phases},
+            "background": {k: round(v, 3) for k, v in self.background},
+            "total_s": round(self._last - self.t0, 3),
+        }
+
+    def report(self):
+        print("[STARTUP] " + " | ".join(f"{k} {v:.2f}s" for k, v in self.phases)
+              + f" | total {self._last - self.t0:.2f}s")
+        if self.background:
+            print("[STARTUP] background: " + " | ".join(f"{k} {v:.2f}s" for k, v in self.background))
+
+
+class StartupJobs:
+    """Named init jobs: run on a daemon thread when FAST_START, inline otherwise."""
+
+    def __init__(self, timer):
+        self._timer = timer
+        self._jobs = {}
+
+    def start(self, name, fn):
+        job = {"done": threading.Event(), "result": None}
+        self._jobs[name] = job
+
+        def _run():
+            t0 = time.perf_counter()
+            try:
+                job["result"] = fn()
+            except Exception as e:
+                print(f"⚠️ Startup job '{name}' failed:", e)
+            finally:
+                self._timer.background.append((name, time.perf_counter() - t0))
+                job["done"].set()
+
+        if FAST_START:
+            threading.Thread(target=_run, name=f"Startup-{name}", daemon=True).start()
+        else:
+            _run()
+
+    def started(self, name):
+        return name in self._jobs
+
+    def pending(self, name):
+        """True while a started job is still running."""
+        job = self._jobs.get(name)
+        return job is not None and not job["done"].is_set()
+
+    def result(self, name, timeout=None):
+        """Job result (None if the job was never started, failed, or timed out)."""
+        job = self._jobs.get(name)
+        if job is None:
+            return None
+        job["done"].wait(timeout)
+        return job["result"]
+
+
+startup = StartupTimer()  # Set startup
+startup_jobs = StartupJobs(startup)  # Set startup_jobs
+
 # ---------------- BIDS-style output naming ----------------
 # Matches LabRecorder-style conventions (e.g., sub-P001_ses-S032_task-Default_run-001_*.xdf)
 # We write the BART outputs into:
@@ -146,6 +236,8 @@ def prompt_bids_ids(win):  # Define function prompt_bids_ids
 SIMULATE_NF = False  # Set SIMULATE_NF
 SHOW_NF_HUD = True  # Set SHOW_NF_HUD
 SHAM_NF = True  # Set SHAM_NF
+FAST_START = True  # ID prompt first; LSL resolve + chime audio init in the background, stimuli built lazily (False = old serial startup)
+LSL_RESOLVE_WAIT_S = 3.0  # FAST_START: max wait for the background LSL resolve at NF connect (then NF connects later, never a second resolve)
 
 
 # ----------------------------------------------------------------------
@@ -166,6 +258,7 @@ MANIFEST_COND_COL = "condition"
 MANIFEST_NAME_COL = "name"
 MANIFEST_HILO_COL = "high/low"  # matches your manifest header exactly
 MANIFEST_OVERRIDES_MODES = True
+MANIFEST_INDEX_SUFFIX = ".index.json"  # subject index cached next to the manifest; rebuilt when the manifest changes
 
 # Filled after ID entry
 MANIFEST_ROW = {}
@@ -197,20 +290,19 @@ def _find_manifest_path():
             return p
     return None
 
-def load_manifest_row_for_subject(subject_id):
-    """Return dict(row) from manifest.xlsx for this subject_id (or {{}} if not found)."""
-    path = _find_manifest_path()
-    if not path:
-        return {}
+def _manifest_value(v):
+    """Cell value as stored in the index cache (JSON types kept, anything else as str)."""
+    return v if (v is None or isinstance(v, (str, int, float, bool))) else str(v)
+
+def _build_manifest_index(path):
+    """Read the manifest sheet once (read-only, values only) → {_norm_sub_id(id): row dict}."""
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
     try:
-        import openpyxl
-        wb = openpyxl.load_workbook(path, data_only=True)
         ws = wb[MANIFEST_SHEETNAME] if (MANIFEST_SHEETNAME and MANIFEST_SHEETNAME in wb.sheetnames) else wb.worksheets[0]
-        # headers
-        headers = [ws.cell(row=1, column=c).value for c in range(1, ws.max_column + 1)]
-        headers = [("" if h is None else str(h).strip()) for h in headers]
-        col_map = {h: i+1 for i, h in enumerate(headers) if h}
-        # locate required columns
+        rows = ws.iter_rows(values_only=True)
+        headers = [("" if h is None else str(h).strip()) for h in (next(rows, None) or ())]
+        col_map = {h: i for i, h in enumerate(headers) if h}
         if MANIFEST_ID_COL not in col_map:
             # try case-insensitive fallback
             for h in list(col_map.keys()):
@@ -219,16 +311,66 @@ def load_manifest_row_for_subject(subject_id):
                     break
         if MANIFEST_ID_COL not in col_map:
             return {}
-        sid_key = _norm_sub_id(subject_id)
-        # scan rows
-        for r in range(2, ws.max_row + 1):
-            sid = ws.cell(row=r, column=col_map[MANIFEST_ID_COL]).value
-            if _norm_sub_id(sid) == sid_key:
-                row = {}
-                for h, cidx in col_map.items():
-                    row[h] = ws.cell(row=r, column=cidx).value
-                return row
+        id_idx = col_map[MANIFEST_ID_COL]
+        index = {}
+        for vals in rows:
+            key = _norm_sub_id(vals[id_idx] if id_idx < len(vals) else None)
+            if not key or key in index:  # first matching row wins (as the old top-down scan)
+                continue
+            index[key] = {h: _manifest_value(vals[c] if c < len(vals) else None) for h, c in col_map.items()}
+        return index
+    finally:
+        wb.close()
+
+def _file_sha1(path):
+    import hashlib
+    h = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _load_manifest_index(path):
+    """Subject index for `path`, from the <manifest>.index.json cache when the manifest is unchanged.
+
+    The cache is valid when mtime+size match, or (file copied/touched) when its SHA-1 matches;
+    otherwise the sheet is re-read and the cache rewritten.
+    """
+    st = os.stat(path)
+    cache_path = path + MANIFEST_INDEX_SUFFIX
+    key = {"sheet": MANIFEST_SHEETNAME, "id_col": MANIFEST_ID_COL}
+    cached = load_sidecar(cache_path)
+    digest = None
+    if cached.get("key") == key and isinstance(cached.get("index"), dict):
+        if cached.get("mtime_ns") == st.st_mtime_ns and cached.get("size") == st.st_size:
+            return cached["index"]
+        digest = _file_sha1(path)
+        if cached.get("sha1") != digest:
+            cached = {}
+    else:
+        cached = {}
+    index = cached.get("index")
+    if index is None:
+        index = _build_manifest_index(path)
+    try:
+        write_sidecar(cache_path, {
+            "key": key,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "sha1": digest or _file_sha1(path),
+            "index": index,
+        })
+    except Exception as e:
+        print(f"⚠️ Could not write manifest index cache: {e}")
+    return index
+
+def load_manifest_row_for_subject(subject_id):
+    """Return dict(row) from manifest.xlsx for this subject_id (or {{}} if not found)."""
+    path = _find_manifest_path()
+    if not path:
         return {}
+    try:
+        return dict(_load_manifest_index(path).get(_norm_sub_id(subject_id), {}))
     except Exception as e:
         print(f"⚠️ Manifest read failed: {e}")
         return {}
@@ -271,7 +413,7 @@ NIGHT_MODE = True  # True = softer/lower-contrast UI to reduce eye strain; False
 # LSL IMPORTS
 # ----------------------------------------------------------------------
 
-from pylsl import StreamInfo, StreamOutlet  # Import dependency
+from pylsl import StreamInfo, StreamOutlet, local_clock  # Import dependency
 try:  # Begin protected block (handle errors)
     from pylsl import StreamInlet, resolve_byprop as _resolve_byprop  # Import dependency
 
@@ -307,6 +449,22 @@ WIN_S = 2.0  # Set WIN_S
 WIN_SAMPLES = int(FS * WIN_S)  # Set WIN_SAMPLES
 
 FRONTAL_IDXS = [5, 6]  # Set FRONTAL_IDXS
+NF_LOCAL_THETA = False  # True = also compute spectral features in-task from the raw EEG stream (EEG_STREAM_NAME)
+NF_SPECTRAL_METHOD = "fft"  # "fft" = band-limited DFT of the window; "sdft" = sliding DFT, updates band bins per sample;
+                            # "welch" / "multitaper" = tapered PSD (precomputed tapers, one batched matmul): less
+                            # leakage from strong neighbouring peaks; for a 4 Hz band over a 2 s window the
+                            # variance is no lower than "fft" (see nf_spectral.TaperedBandPower)
+NF_WELCH_SEG_S = 1.0  # Welch segment length (s); Hann window
+NF_WELCH_OVERLAP = 0.5  # Welch segment overlap fraction
+NF_MT_NW = 2.0  # multitaper time-bandwidth product (DPSS; sine tapers if SciPy is unavailable)
+NF_MT_TAPERS = None  # number of tapers (None = 2*NW - 1)
+
+# In-task spectral feature pipeline (NF_LOCAL_THETA): a (channels x bands) power matrix per update
+NF_BANDS = {"theta": THETA_BAND, "alpha": (8.0, 13.0), "beta": (13.0, 30.0)}  # name -> (lo, hi) Hz
+NF_FEATURE_CHANNELS = None  # None = every channel in the EEG stream (16 on actiCAP); else list of stream indices
+NF_METRIC = "theta"  # NF metric over the matrix: "band", "bandA/bandB" (e.g. "theta/beta"), or a callable(power, bands, channels)
+NF_METRIC_CHANNELS = FRONTAL_IDXS  # stream indices the metric averages over (None = all feature channels)
+NF_LOG_FEATURES = True  # write every feature row to <bids>_nffeatures.csv
 
 Z_HIGH = 0.3  # Set Z_HIGH
 Z_LOW = -0.7  # Set Z_LOW
@@ -412,6 +570,7 @@ Z_ALPHA = 0.6  # Set Z_ALPHA
 
 NF_UPDATE_HZ = 10.0  # Set NF_UPDATE_HZ
 NF_UPDATE_INTERVAL = 1.0 / NF_UPDATE_HZ  # Set NF_UPDATE_INTERVAL
+NF_ACQ_THREAD = True  # EEG/LSL mode: drain inlets + compute z on a background thread; the frame loop only reads the latest value
 NF_COLOR_UPDATE_INTERVAL = 1.0  # Set NF_COLOR_UPDATE_INTERVAL
 
 
@@ -434,14 +593,38 @@ END_CHIME_HZ  = 880.0  # Set END_CHIME_HZ
 END_CHIME_DUR = 0.30   # seconds
 END_CHIME_VOL = 0.25   # 0..1 (keep modest to reduce startling)
 
-try:  # Begin protected block (handle errors)
-    end_chime = sound.Sound(value=END_CHIME_HZ, secs=END_CHIME_DUR, stereo=True)  # Set end_chime
-    end_chime.setVolume(END_CHIME_VOL)  # Execute statement
-    CHIME_OK = True  # Set CHIME_OK
-except Exception as _e:  # Handle an error case
-    print("⚠️ Chime sound init failed (audio unavailable):", _e)  # Print debug/status message
-    end_chime = None  # Set end_chime
-    CHIME_OK = False  # Set CHIME_OK
+def _init_chime():  # Define function _init_chime
+    """Create the rest-end chime (first Sound() also initialises the audio backend)."""  # Docstring
+    try:  # Begin protected block (handle errors)
+        snd = sound.Sound(value=END_CHIME_HZ, secs=END_CHIME_DUR, stereo=True)  # Set snd
+        snd.setVolume(END_CHIME_VOL)  # Execute statement
+        return snd  # Return value from function
+    except Exception as _e:  # Handle an error case
+        print("⚠️ Chime sound init failed (audio unavailable):", _e)  # Print debug/status message
+        return None  # Return value from function
+
+def _resolve_lsl_streams(attempts=10, sleep_s=0.2):  # Define function _resolve_lsl_streams
+    """Resolve the NF_Z (and, for NF_LOCAL_THETA, raw EEG) streams; same attempts as try_connect()."""  # Docstring
+    out = {"nf": [], "eeg": []}  # Set out
+    if not LSL_OK:  # Conditional branch
+        return out  # Return value from function
+    if NF_LOCAL_THETA:  # Conditional branch
+        out["eeg"] = resolve_byprop('name', EEG_STREAM_NAME, timeout=1.0) or []  # Execute statement
+    for _ in range(attempts):  # Loop over items
+        out["nf"] = resolve_byprop('name', 'NF_Z', timeout=1.0) or resolve_byprop('type', 'NF', timeout=1.0) or []  # Execute statement
+        if out["nf"]:  # Conditional branch
+            break  # Exit current loop
+        time.sleep(sleep_s)  # Execute statement
+    return out  # Return value from function
+
+# Set at the main entry point from the "audio" job (run_rest_block checks both)
+end_chime = None  # Set end_chime
+CHIME_OK = False  # Set CHIME_OK
+startup_jobs.start("audio", _init_chime)  # background when FAST_START
+if FAST_START and not (SHAM_NF or SIMULATE_NF):  # Conditional branch
+    # Default flags already mean live NF: resolve during window setup + the ID prompt
+    # (if the manifest then switches to SHAM, the result is simply never read)
+    startup_jobs.start("lsl_resolve", _resolve_lsl_streams)  # Execute statement
 
 GREEN_SUCCESS_FRAC   = 0.60  # Set GREEN_SUCCESS_FRAC
 GREEN_STREAK_TARGET  = 3  # Set GREEN_STREAK_TARGET
@@ -452,6 +635,12 @@ GRAPH_WIDTH  = 320  # Set GRAPH_WIDTH
 GRAPH_HEIGHT = 160  # Set GRAPH_HEIGHT
 GRAPH_POS    = (-420, -300)  # Set GRAPH_POS
 GRAPH_Z_RANGE = 2.5  # Set GRAPH_Z_RANGE
+MARKER_ASYNC = True  # push LSL markers from a dispatcher thread (render loop only enqueues)
+MARKER_QUEUE_SIZE = 256  # preallocated marker slots; markers submitted while full are dropped and counted
+WRITE_PARQUET = True  # also write <stem>_beh/_pumps/_nf.parquet at exit (needs pyarrow; skipped with a warning otherwise)
+FRAME_PROFILE = False  # opt-in: per-frame flip times + CPU per section in run_trial → <stem>_frames.csv and XLSX 'frames' sheet
+FRAME_PROFILE_MAX = 36000  # frames stored per trial (~10 min at 60 Hz); extra frames are only counted
+NF_HISTORY_LEN = 240  # NF samples kept in the z/theta ring histories (~24 s at NF_UPDATE_HZ=10)
 
 # ----------------------------------------------------------------------
 # WINDOW
@@ -480,12 +669,183 @@ def safe_flip():  # Define function safe_flip
         print("Flip error:", e)  # Print debug/status message
         return False  # Return value from function
 
+startup.mark("window")  # Execute statement
+
+
+class FrameTimeLog:
+    """Preallocated log of flip timestamps with a dropped-frame summary.
+
+    A frame counts as dropped when its flip interval exceeds DROP_FACTOR x the
+    median interval (i.e., at least one vsync was missed).
+    """
+
+    DROP_FACTOR = 1.5
+
+    def __init__(self, capacity):
+        self.t = np.zeros(max(2, int(capacity)), dtype=float)
+        self.n = 0
+
+    def reset(self):
+        self.n = 0
+
+    def stamp(self, t):
+        if self.n < self.t.shape[0]:
+            self.t[self.n] = t
+            self.n += 1
+
+    def flip(self):
+        """safe_flip() and record the time the flip returned."""
+        ok = safe_flip()
+        self.stamp(core.getTime())
+        return ok
+
+    def intervals(self):
+        return np.diff(self.t[:self.n])
+
+    def summary(self):
+        dt = self.intervals()
+        if dt.size == 0:
+            return {"frames": int(self.n), "dropped": 0, "median_ms": float('nan'), "max_ms": float('nan')}
+        med = float(np.median(dt))
+        return {
+            "frames": int(self.n),
+            "dropped": int(np.count_nonzero(dt > self.DROP_FACTOR * med)),
+            "median_ms": med * 1000.0,
+            "max_ms": float(dt.max()) * 1000.0,
+        }
+
+
+class FrameProfiler(FrameTimeLog):
+    """Opt-in per-frame profiler for run_trial (FRAME_PROFILE).
+
+    For every flip it stores the flip time plus CPU time (ms, perf_counter) spent in
+    each SECTIONS entry since the previous flip, in preallocated arrays. end_trial()
+    appends the trial's frames to a CSV, keeps a per-trial summary row (for the
+    XLSX 'frames' sheet) and resets. Missed vsyncs per frame are round(dt / median) - 1.
+    """
+
+    SECTIONS = ("nf", "keys", "fade", "logic", "draw")
+
+    def __init__(self, path, capacity=FRAME_PROFILE_MAX):
+        super().__init__(capacity)
+        self.cpu = np.zeros((self.t.shape[0], len(self.SECTIONS)), dtype=float)
+        self._col = {name: i for i, name in enumerate(self.SECTIONS)}
+        self._mark = time.perf_counter()
+        self.overflow = 0
+        self.path = path
+        self._fh = None
+        self._writer = None
+        self.summaries = []
+
+    def reset(self):
+        self.n = 0
+        self.overflow = 0
+        self.cpu[0] = 0.0
+
+    def mark(self):
+        self._mark = time.perf_counter()
+
+    def lap(self, section):
+        """Charge the time since the last mark/lap to `section` for the current frame."""
+        now = time.perf_counter()
+        if self.n < self.t.shape[0]:
+            self.cpu[self.n, self._col[section]] += (now - self._mark) * 1000.0
+        self._mark = now
+
+    def stamp(self, t):
+        if self.n < self.t.shape[0]:
+            self.t[self.n] = t
+            self.n += 1
+            if self.n < self.t.shape[0]:
+                self.cpu[self.n] = 0.0
+        else:
+            self.overflow += 1
+
+    def flip(self):
+        ok = FrameTimeLog.flip(self)
+        self._mark = time.perf_counter()
+        return ok
+
+    def end_trial(self, block, trial):
+        """Write this trial's frames, store its summary row and reset for the next trial."""
+        n = self.n
+        dt = self.intervals()
+        med = float(np.median(dt)) if dt.size else float('nan')
+        missed = np.maximum(0.0, np.rint(dt / med) - 1.0) if dt.size else dt
+        cpu = self.cpu[:n]
+        st = self.summary()
+        row = {
+            "block": block,
+            "trial": trial,
+            "frames": st["frames"] + self.overflow,
+            "dropped": st["dropped"],
+            "missed_vsyncs": int(missed.sum()) if dt.size else 0,
+            "median_ms": round(st["median_ms"], 3),
+            "p95_ms": round(float(np.percentile(dt, 95)) * 1000.0, 3) if dt.size else float('nan'),
+            "max_ms": round(st["max_ms"], 3),
+        }
+        for name, j in self._col.items():
+            row[f"{name}_mean_ms"] = round(float(cpu[:, j].mean()), 4) if n else float('nan')
+        row["cpu_max_ms"] = round(float(cpu.sum(axis=1).max()), 4) if n else float('nan')
+        self.summaries.append(row)
+        if row["dropped"]:
+            print(f"[FRAMES] {block} trial {trial}: {row['dropped']} dropped / {row['frames']} "
+                  f"(max {row['max_ms']:.1f} ms, median {row['median_ms']:.2f} ms)")
+
+        try:
+            if self._writer is None:
+                self._fh = open(self.path, "w", newline="")
+                self._writer = csv.writer(self._fh)
+                self._writer.writerow(["block", "trial", "frame", "flip_time", "interval_ms", "missed_vsyncs"]
+                                      + [f"{name}_ms" for name in self.SECTIONS])
+            ivl = np.concatenate(([np.nan], dt * 1000.0)).round(3).tolist()
+            mis = np.concatenate(([0.0], missed)).astype(int).tolist()
+            flips = self.t[:n].tolist()
+            secs = cpu.round(4).tolist()
+            self._writer.writerows(
+                [block, trial, i, flips[i], ("" if i == 0 else ivl[i]), mis[i]] + secs[i] for i in range(n)
+            )
+            self._fh.flush()
+        except Exception as e:
+            print("⚠️ Could not write frame profile:", e)
+        self.reset()
+
+    def close(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except Exception:
+                pass
+            self._fh = None
+            self._writer = None
+
+
+class _NoFrameProfiler:
+    """Stand-in used when FRAME_PROFILE is off: flip() is a plain safe_flip()."""
+
+    summaries = []
+
+    def mark(self):
+        pass
+
+    def lap(self, section):
+        pass
+
+    def flip(self):
+        return safe_flip()
+
+    def end_trial(self, block, trial):
+        pass
+
+    def close(self):
+        pass
+
 # ----------------------------------------------------------------------
 # LSL MARKER STREAM
 # ----------------------------------------------------------------------
 
 info = StreamInfo(
-    name="BART_Markers",
+    name=MARKER_STREAM_NAME,
     type="Markers",
     channel_count=1,
     nominal_srate=0,
@@ -494,31 +854,343 @@ info = StreamInfo(
 )
 outlet = StreamOutlet(info)  # Set outlet
 
-def send_marker(code: str, **data):  # Define function send_marker
-    t = core.getTime()  # Set t
+# Numeric twin of BART_Markers: same events, fixed float32 schema (bart_events.MARKER_CHANNELS)
+num_info = StreamInfo(
+    name=NUMERIC_MARKER_STREAM_NAME,
+    type="Markers",
+    channel_count=len(MARKER_CHANNELS),
+    nominal_srate=0,
+    channel_format="float32",
+    source_id="bart_psychopy_num",
+)
+try:  # Begin protected block (handle errors)
+    _chns = num_info.desc().append_child("channels")  # Set _chns
+    for _label in MARKER_CHANNELS:  # Loop over items
+        _chns.append_child("channel").append_child_value("label", _label)  # Execute statement
+except Exception:  # Handle an error case
+    pass  # No-op placeholder
+num_outlet = StreamOutlet(num_info)  # Set num_outlet
+_marker_row = np.full(len(MARKER_CHANNELS), np.nan, dtype=np.float32)  # Reused numeric marker sample
+
+class MarkerDispatcher:
+    """Background sender for LSL markers with a bounded, preallocated queue.
+
+    submit() only stores (code, data, t, lsl_t) in a fixed ring of slots and wakes the
+    thread; formatting and push_sample() happen on the dispatcher thread. The caller's
+    timestamps are kept, so queueing delay never shifts a marker in time. When the ring
+    is full the new marker is dropped and counted (_push_marker has already
+    journalled it, flagged lsl_dropped). Push errors are counted (first one
+    printed) instead of being swallowed silently.
+    """
+
+    def __init__(self, send, size=MARKER_QUEUE_SIZE):
+        self._send = send  # send(code, data, t, lsl_t)
+        self._slots = [None] * int(size)
+        self._head = 0   # next slot to send
+        self._count = 0  # queued markers
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        # counters
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.latency_sum = 0.0  # s, submit → push returned
+        self.latency_max = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="MarkerDispatcher", daemon=True)
+        self._thread.start()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop
+
+    def depth(self):
+        return self._count
+
+    def full(self):
+        return self._count >= len(self._slots)
+
+    def submit(self, code, data, t, lsl_t):
+        with self._cond:
+            n = len(self._slots)
+            if self._count >= n:
+                self.dropped += 1
+                return False
+            self._slots[(self._head + self._count) % n] = (code, data, t, lsl_t, local_clock())
+            self._count += 1
+            self.submitted += 1
+            if self._count > self.max_depth:
+                self.max_depth = self._count
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        n = len(self._slots)
+        while True:
+            with self._cond:
+                while self._count == 0 and not self._stop:
+                    self._cond.wait()
+                if self._count == 0:
+                    return
+                item = self._slots[self._head]
+                self._slots[self._head] = None
+            code, data, t, lsl_t, t_submit = item
+            try:
+                self._send(code, data, t, lsl_t)
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print("⚠️ Marker push failed:", e)
+            lat = local_clock() - t_submit
+            self.latency_sum += lat
+            if lat > self.latency_max:
+                self.latency_max = lat
+            with self._cond:
+                # release the slot only after the push so drain() waits for in-flight markers
+                self._head = (self._head + 1) % n
+                self._count -= 1
+                self._cond.notify_all()
+
+    def drain(self, timeout=2.0):
+        """Send everything still queued, stop the thread and print the counters."""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + float(timeout)
+        with self._cond:
+            while self._count > 0 and self._thread.is_alive():
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout=0.5)
+        print(self.report())
+
+    def report(self):
+        n = max(1, self.sent + self.errors)
+        return (f"[MARKERS] submitted={self.submitted} sent={self.sent} dropped={self.dropped} "
+                f"errors={self.errors} left={self._count} max_depth={self.max_depth} "
+                f"latency mean={1000.0 * self.latency_sum / n:.2f}ms max={1000.0 * self.latency_max:.2f}ms")
+
+
+class MarkerJournal:
+    """Append-only JSONL copy of every marker (recovery if the LSL marker stream is lost).
+
+    One line per marker: {"seq", "code", "t" (core.getTime), "lsl_t" (pylsl.local_clock), "data"},
+    plus "lsl_dropped": true when the marker never reached LSL (dispatcher queue full).
+    Recorded on the calling thread before the marker is queued for LSL.
+    Lines are buffered in memory and written + fsync'd when a SYNC_CODES marker (trial /
+    block boundary) is recorded, or on close(). Markers recorded before open() are kept
+    and written once the output folder is known. Load with bart_events.load_marker_journal().
+    """
+
+    SYNC_CODES = frozenset(("BART_ITI", "BART_ABORT", "BART_END", "REST_END",
+                            "BART_PRACTICE_END", "BART_BASELINE_END", "BART_INSTRUCTIONS_END"))
+
+    def __init__(self):
+        self.path = None
+        self._fh = None
+        self._buf = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        with self._lock:
+            try:
+                self._fh = open(path, "a", encoding="utf-8")
+                self.path = path
+            except Exception as e:
+                print("⚠️ Could not open marker journal:", e)
+                self._fh = None
+        self.sync()
+
+    def record(self, code, data, t, lsl_t, lsl_dropped=False):
+        with self._lock:
+            rec = {"seq": self._seq, "code": code, "t": t, "lsl_t": lsl_t, "data": data}
+            if lsl_dropped:
+                rec["lsl_dropped"] = True
+            self._buf.append(json.dumps(rec, separators=(",", ":"), default=str))
+            self._seq += 1
+        if code in self.SYNC_CODES:
+            self.sync()
+
+    def sync(self):
+        """Write buffered lines, flush and fsync (no-op until open())."""
+        with self._lock:
+            if self._fh is None or not self._buf:
+                return
+            try:
+                self._fh.write("\n".join(self._buf) + "\n")
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+                self._buf = []
+            except Exception as e:
+                print("⚠️ Marker journal write failed:", e)
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._fh is not None:
+                try:
+                    self._fh.close()
+                except Exception:
+                    pass
+                self._fh = None
+
+marker_journal = MarkerJournal()  # Set marker_journal (opened once the BIDS output folder is known)
+
+def _send_marker_now(code: str, data: dict, t: float, lsl_t: float):  # Define function _send_marker_now
+    """Format and push one marker to both outlets (dispatcher thread, or caller when MARKER_ASYNC is off)."""  # Docstring
     meta = ";".join([f"{k}={v}" for k, v in data.items()])  # Set meta
     msg = f"{code};timestamp={t};{meta}"  # Set msg
+    outlet.push_sample([msg], timestamp=lsl_t)  # Execute statement
+    num_outlet.push_sample(encode_marker(code, data, _marker_row), timestamp=lsl_t)  # Execute statement
+
+marker_dispatcher = MarkerDispatcher(_send_marker_now)  # Set marker_dispatcher
+if MARKER_ASYNC:  # Conditional branch
+    marker_dispatcher.start()  # Execute statement
+
+def _push_marker(code: str, data: dict, t: float, lsl_t=None):  # Define function _push_marker
+    """Queue (or push) one marker; lsl_t (pylsl.local_clock) overrides the LSL sample time."""  # Docstring
+    if lsl_t is None:  # Conditional branch
+        lsl_t = local_clock()  # Same LSL time on both marker streams, taken at the call
+    queued = marker_dispatcher.running()  # Set queued
+    # Journal first, on this thread: a marker the full queue drops (or a failed push) is still on disk,
+    # flagged so offline analysis can tell it is missing from the XDF marker streams
+    marker_journal.record(code, data, t, lsl_t, lsl_dropped=(queued and marker_dispatcher.full()))  # Execute statement
+    if queued:  # Conditional branch
+        if not marker_dispatcher.submit(code, data, t, lsl_t) and marker_dispatcher.dropped == 1:  # Conditional branch
+            print("⚠️ Marker queue full; dropped markers are kept in the journal (lsl_dropped)")  # Print debug/status message
+        return  # Return value from function
     try:  # Begin protected block (handle errors)
-        outlet.push_sample([msg])  # Execute statement
-    except Exception:  # Handle an error case
-        pass  # No-op placeholder
+        _send_marker_now(code, data, t, lsl_t)  # Execute statement
+    except Exception as e:  # Handle an error case
+        marker_dispatcher.errors += 1  # Execute statement
+        if marker_dispatcher.errors == 1:  # Conditional branch
+            print("⚠️ Marker push failed:", e)  # Print debug/status message
+
+def send_marker(code: str, **data):  # Define function send_marker
+    """Push a marker immediately (for events with no screen change: ABORT, ITI, END, responses...)."""  # Docstring
+    _push_marker(code, data, core.getTime())  # Call _push_marker()
+
+# ----------------------------------------------------------------------
+# FLIP-LOCKED MARKERS
+# NOTE: schedule_marker() queues a marker and pushes it from win.callOnFlip, i.e. right after the
+# buffer swap that shows the event. Both the string timestamp (core.getTime) and the LSL sample
+# time (local_clock) are the post-flip time, so ERP anchors carry no draw/vsync jitter.
+# Call it BEFORE the flip that shows the stimulus.
+# ----------------------------------------------------------------------
+
+_flip_markers = []  # (code, data) waiting for the next flip
+_flip_markers_armed = False  # callOnFlip hook registered for the next flip
+
+def _flush_flip_markers():  # Define function _flush_flip_markers
+    """callOnFlip hook: push every queued marker with the flip timestamp."""  # Docstring
+    global _flip_markers_armed
+    _flip_markers_armed = False  # Execute statement
+    if not _flip_markers:  # Conditional branch
+        return  # Return value from function
+    t = core.getTime()  # Set t
+    lsl_t = local_clock()  # Set lsl_t
+    pending = _flip_markers[:]  # Set pending
+    del _flip_markers[:]  # Execute statement
+    for code, data in pending:  # Loop over items
+        _push_marker(code, data, t, lsl_t)  # Call _push_marker()
+
+def schedule_marker(code: str, **data):  # Define function schedule_marker
+    """Queue a marker to be pushed with the timestamp of the next win.flip()."""  # Docstring
+    global _flip_markers_armed
+    _flip_markers.append((code, data))  # Execute statement
+    if not _flip_markers_armed:  # Conditional branch
+        try:  # Begin protected block (handle errors)
+            win.callOnFlip(_flush_flip_markers)  # Execute statement
+            _flip_markers_armed = True  # Execute statement
+        except Exception:  # Handle an error case
+            _flush_flip_markers()  # No flip hook available: send now
 
 def cleanup_and_exit(fh=None, send_final=True, total_bank=0):  # Define function cleanup_and_exit
     """Close files/window safely. Also writes an XLSX copy of the CSV data."""  # Start/continue docstring
     try:  # Begin protected block (handle errors)
+        try:  # Begin protected block (handle errors)
+            _flush_flip_markers()  # Send any flip-locked markers that never got their flip
+        except Exception:  # Handle an error case
+            pass  # No-op placeholder
+        try:  # Begin protected block (handle errors)
+            if 'nf' in globals():  # Conditional branch
+                nf.stop_acquisition()  # Stop background NF thread before closing
+                nf.close_feature_log()  # Flush per-update spectral features
+            if 'frame_profiler' in globals():  # Conditional branch
+                frame_profiler.close()  # Close per-frame timing CSV
+        except Exception:  # Handle an error case
+            pass  # No-op placeholder
+
         if send_final:  # Conditional branch
             try:  # Begin protected block (handle errors)
-                outlet.push_sample([f"BART_END;timestamp={core.getTime()};total={total_bank}"])  # Execute statement
+                _push_marker("BART_END", {"total": total_bank}, core.getTime())  # Execute statement
             except Exception:  # Handle an error case
                 pass  # No-op placeholder
 
-        # Try XLSX export before closing (uses rows_buffer accumulated during the run)
+        try:  # Begin protected block (handle errors)
+            marker_dispatcher.drain()  # Send queued markers before LSL/window go away
+        except Exception:  # Handle an error case
+            pass  # No-op placeholder
+        try:  # Begin protected block (handle errors)
+            marker_journal.close()  # Final write + fsync of the marker journal
+        except Exception:  # Handle an error case
+            pass  # No-op placeholder
+
+        # Session sidecar (<stem>_beh.json): final rewrite with whatever the run reached
+        # (also rewritten during the run after each rest block / baseline, so a crash keeps it)
+        sidecar = {}  # Set sidecar
+        if 'csvfile' in globals() and 'save_session_sidecar' in globals():  # Conditional branch
+            sidecar = save_session_sidecar()  # Set sidecar
+
+        # Pump table for the exporters, straight from the pump event log
+        pumps = []  # Set pumps
+        if 'pump_log' in globals():  # Conditional branch
+            try:  # Begin protected block (handle errors)
+                pump_log.close()  # Final append + fsync of <stem>_pumps.bin
+                pumps = pump_event_rows(pump_log.view(), globals().get("rows_buffer", []))  # Set pumps
+            except Exception as e:  # Handle an error case
+                print("⚠️ Could not build pump table:", e)  # Print debug/status message
+
+        # Try XLSX export before closing (wide layout: rows_buffer + sidecar columns)
         try:  # Begin protected block (handle errors)
             if 'xlsxfile' in globals() and 'rows_buffer' in globals() and 'FIELDNAMES' in globals():  # Conditional branch
-                write_xlsx(xlsxfile, rows_buffer, FIELDNAMES)  # Call write_xlsx()
+                frame_rows = frame_profiler.summaries if 'frame_profiler' in globals() else None  # Set frame_rows
+                write_xlsx(xlsxfile, widen_rows(rows_buffer, sidecar), wide_fieldnames(FIELDNAMES),
+                           pump_rows=pumps, frame_rows=frame_rows)  # Call write_xlsx()
         except Exception as e:  # Handle an error case
             print("⚠️ XLSX export failed:", e)  # Print debug/status message
 
+        # Columnar copies of the same tables (typed Parquet; much faster to load than XLSX)
+        if WRITE_PARQUET and 'csvfile' in globals() and 'rows_buffer' in globals():  # Conditional branch
+            def _write_table(table, rows, columns, types):  # One table per call, so a bad table does not lose the others
+                try:  # Begin protected block (handle errors)
+                    return write_parquet(parquet_path(csvfile, table), rows, columns, types)  # Return value from function
+                except Exception as e:  # Handle an error case
+                    print(f"⚠️ Parquet export failed ({table}):", e)  # Print debug/status message
+                    return True  # pyarrow is there; only this table failed
+
+            if _write_table("trials", widen_rows(rows_buffer, sidecar), wide_fieldnames(FIELDNAMES), TRIAL_TYPES):  # Conditional branch
+                _write_table("pumps", pumps, PUMP_COLUMNS, PUMP_TYPES)  # Call _write_table()
+                _write_table("nf", nf_sample_rows(globals().get("rest_metrics")), list(NF_SAMPLE_TYPES), NF_SAMPLE_TYPES)  # Call _write_table()
+            else:  # Fallback branch
+                print("⚠️ pyarrow not available; Parquet output skipped")  # Print debug/status message
+
+        if 'trial_writer' in globals():  # Conditional branch
+            try:  # Begin protected block (handle errors)
+                trial_writer.close()  # Drains queued rows and closes the CSV
+            except Exception:  # Handle an error case
+                pass  # No-op placeholder
         if fh:  # Conditional branch
             try:  # Begin protected block (handle errors)
                 fh.flush()  # Execute statement
@@ -533,22 +1205,66 @@ def cleanup_and_exit(fh=None, send_final=True, total_bank=0):  # Define function
     finally:  # Run cleanup regardless of errors
         raise SystemExit(0)  # Raise exception to stop/handle flow
 
+startup.mark("outlets + helpers")  # Execute statement
+
 # ----------------------------------------------------------------------
 # VISUAL STIMULI
+# NOTE: With FAST_START every stimulus below is a LazyStim proxy: the PsychoPy object is
+# built on first use, or earlier by build_pending_stimuli() while an untimed screen waits
+# for a key (rest overview), so nothing is constructed inside a timed block.
 # ----------------------------------------------------------------------
 
-trial_text = visual.TextStim(win, pos=(0, 360), height=22, color=UI_TEXT_COLOR)  # Set trial_text
-total_text = visual.TextStim(win, pos=(420, 360), height=20, color=UI_TEXT_COLOR)  # Set total_text
+class LazyStim:
+    """Proxy that builds its stimulus on first attribute access and then forwards to it."""
 
-balloon = visual.Circle(
+    pending = []  # proxies not built yet, in creation order
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_stim", None)
+        LazyStim.pending.append(self)
+
+    def build(self):
+        stim = object.__getattribute__(self, "_stim")
+        if stim is None:
+            stim = object.__getattribute__(self, "_factory")()
+            object.__setattr__(self, "_stim", stim)
+        return stim
+
+    def __getattr__(self, name):  # only reached for names not on the proxy itself
+        return getattr(self.build(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.build(), name, value)
+
+
+def stim(factory):  # Define function stim
+    """Lazy proxy (FAST_START) or the stimulus itself."""  # Docstring
+    return LazyStim(factory) if FAST_START else factory()  # Return value from function
+
+
+def build_pending_stimuli(budget_s=None):  # Define function build_pending_stimuli
+    """Build not-yet-used lazy stimuli (all, or until budget_s has elapsed). Returns how many remain."""  # Docstring
+    t0 = time.perf_counter()  # Set t0
+    while LazyStim.pending:  # Loop while condition holds
+        LazyStim.pending.pop(0).build()  # Execute statement
+        if budget_s is not None and time.perf_counter() - t0 >= budget_s:  # Conditional branch
+            break  # Exit current loop
+    return len(LazyStim.pending)  # Return value from function
+
+
+trial_text = stim(lambda: visual.TextStim(win, pos=(0, 360), height=22, color=UI_TEXT_COLOR))  # Set trial_text
+total_text = stim(lambda: visual.TextStim(win, pos=(420, 360), height=20, color=UI_TEXT_COLOR))  # Set total_text
+
+balloon = stim(lambda: visual.Circle(
     win,
     radius=BALLOON_START_RADIUS,
     edges=128,
     fillColor=ISO_YELLOW,
     lineColor=None,
-)
+))
 
-pump_dot = visual.Circle(
+pump_dot = stim(lambda: visual.Circle(
     win,
     radius=DOT_RADIUS_PX,  # smaller dot to reduce eye strain
     edges=48,  # still smooth, slightly less visually 'sharp'
@@ -556,40 +1272,40 @@ pump_dot = visual.Circle(
     fillColor=DOT_COLOR,  # slightly gray (less harsh than black)
     opacity=DOT_OPACITY,  # soften the dot edge further
     pos=(0, 0)  # centered inside the balloon
-)
+))
 
-pump_value_text = visual.TextStim(
+pump_value_text = stim(lambda: visual.TextStim(
     win,
     text="",
     pos=(0, 0),
     height=20,
     color=UI_TEXT_COLOR,
     bold=True  # Set bold
-)
+))
 
-fixation = visual.TextStim(win, text="+", height=64, color=UI_TEXT_COLOR)  # Set fixation
+fixation = stim(lambda: visual.TextStim(win, text="+", height=64, color=UI_TEXT_COLOR))  # Set fixation
 
-boom_text = visual.TextStim(win, text="BOOM!", height=44, color=UI_TEXT_COLOR, pos=(0, 24), bold=True)  # Set boom_text
-loss_text = visual.TextStim(win, text="", height=28, color=UI_TEXT_COLOR, pos=(0, -14), bold=True)  # Set loss_text
-collect_text = visual.TextStim(win, text="", height=44, color=UI_TEXT_COLOR, pos=(0, 0), bold=True)  # Set collect_text
+boom_text = stim(lambda: visual.TextStim(win, text="BOOM!", height=44, color=UI_TEXT_COLOR, pos=(0, 24), bold=True))  # Set boom_text
+loss_text = stim(lambda: visual.TextStim(win, text="", height=28, color=UI_TEXT_COLOR, pos=(0, -14), bold=True))  # Set loss_text
+collect_text = stim(lambda: visual.TextStim(win, text="", height=44, color=UI_TEXT_COLOR, pos=(0, 0), bold=True))  # Set collect_text
 
-note_text = visual.TextStim(win, text="", pos=(0, -120), height=24, color="black")  # Set note_text
+note_text = stim(lambda: visual.TextStim(win, text="", pos=(0, -120), height=24, color="black"))  # Set note_text
 
-nf_status = visual.TextStim(
+nf_status = stim(lambda: visual.TextStim(
     win, pos=(-560, 360), height=16,
     color=UI_ACCENT_COLOR  # Set color
-)
+))
 
-bonus_text_main = visual.TextStim(win, text="", height=40, color=UI_TEXT_COLOR, pos=(0, 20))  # Set bonus_text_main
-bonus_text_sub  = visual.TextStim(win, text="", height=24, color=UI_TEXT_COLOR, pos=(0, -30))  # Set bonus_text_sub
+bonus_text_main = stim(lambda: visual.TextStim(win, text="", height=40, color=UI_TEXT_COLOR, pos=(0, 20)))  # Set bonus_text_main
+bonus_text_sub  = stim(lambda: visual.TextStim(win, text="", height=24, color=UI_TEXT_COLOR, pos=(0, -30)))  # Set bonus_text_sub
 
-flash_rect = visual.Rect(
+flash_rect = stim(lambda: visual.Rect(
     win,
     width=SCREEN_SIZE[0],
     height=SCREEN_SIZE[1],
     fillColor=FLASH_COLOR,  # gray flash to reduce luminance transient
     opacity=0.0,
-)
+))
 
 # ----------------------------------------------------------------------
 # BALLOON RESET (robust across GPUs)
@@ -620,27 +1336,58 @@ def reset_balloon_visual(fill_color=None):
 
 
 
-graph_frame = visual.Rect(
+graph_frame = stim(lambda: visual.Rect(
     win,
     width=GRAPH_WIDTH,
     height=GRAPH_HEIGHT,
     lineColor=[0.3, 0.3, 0.3],
     pos=GRAPH_POS,
-)
+))
 
-graph_line = visual.ShapeStim(
+graph_line = stim(lambda: visual.ShapeStim(
     win,
     vertices=[(0, 0), (1, 0)],
     lineColor=UI_ACCENT_COLOR,
     closeShape=False,
-)
+))
 
-graph_zero = visual.Line(
+graph_zero = stim(lambda: visual.Line(
     win,
     start=(GRAPH_POS[0] - GRAPH_WIDTH / 2, GRAPH_POS[1]),
     end=(GRAPH_POS[0] + GRAPH_WIDTH / 2, GRAPH_POS[1]),
     lineColor=[0.2, 0.2, 0.2],
-)
+))
+
+# ----------------------------------------------------------------------
+# REST SCREEN STIMULI
+# NOTE: Built once and reused by the rest / concentrated-rest blocks; loops only change .text when the shown value changes.
+# ----------------------------------------------------------------------
+
+rest_title = stim(lambda: visual.TextStim(win, text="", pos=(0, 220), height=40, color=UI_TEXT_COLOR, bold=True))  # Set rest_title
+rest_body = stim(lambda: visual.TextStim(win, text="", pos=(0, 20), height=26, color=UI_TEXT_COLOR, wrapWidth=1000, alignText="left"))  # Set rest_body
+rest_footer = stim(lambda: visual.TextStim(win, text="Press SPACE to begin", pos=(0, -300), height=22, color=UI_ACCENT_COLOR))  # Set rest_footer
+rest_countdown = stim(lambda: visual.TextStim(win, text="", pos=(0, -140), height=28, color=UI_ACCENT_COLOR))  # Set rest_countdown
+
+conc_title = stim(lambda: visual.TextStim(win, text="Concentrated Rest", height=44, color=UI_TEXT_COLOR, pos=(0, 200), bold=True))  # Set conc_title
+conc_body = stim(lambda: visual.TextStim(
+    win,
+    text=("""A 3-digit number will appear.
+
+Please count backwards out loud or silently by 7s (e.g., 392, 385, 378, ...).
+This is a short concentration rest.
+
+This helps us calibrate the neurofeedback baseline."""),
+    height=26,
+    color=UI_TEXT_COLOR,
+    wrapWidth=1000,
+    pos=(0, 10)
+))
+conc_prompt = stim(lambda: visual.TextStim(win, text="Press SPACE to begin", height=24, color=UI_ACCENT_COLOR, pos=(0, -260)))  # Set conc_prompt
+conc_countdown = stim(lambda: visual.TextStim(win, text="3", height=72, color=UI_TEXT_COLOR, pos=(0, 0), bold=True))  # Set conc_countdown
+conc_num = stim(lambda: visual.TextStim(win, text="", height=72, color=UI_TEXT_COLOR, pos=(0, 40), bold=True))  # Set conc_num
+conc_instr = stim(lambda: visual.TextStim(win, text="Count backwards by 7s", height=28, color=UI_TEXT_COLOR, pos=(0, -60)))  # Set conc_instr
+
+startup.mark("stimuli")  # Execute statement
 
 # ----------------------------------------------------------------------
 # TRIAL SETUP
@@ -668,10 +1415,16 @@ if CONDITION_LABEL:
     print(f"🧾 Manifest condition for sub-{SUB_LABEL}: {CONDITION_LABEL}")
 else:
     print(f"🧾 No manifest match/label for sub-{SUB_LABEL} (continuing with current mode flags).")
+startup.mark("id prompt (operator)")  # Execute statement
+if FAST_START and not (SHAM_NF or SIMULATE_NF) and not startup_jobs.started("lsl_resolve"):  # Conditional branch
+    # Manifest switched a SHAM/SIM default to live NF: resolve from here on, in the background
+    startup_jobs.start("lsl_resolve", _resolve_lsl_streams)  # Execute statement
 
-bids_base = f"sub-{SUB_LABEL}_ses-{SES_LABEL}_task-{TASK_LABEL}_run-{RUN_LABEL}_beh"  # Set bids_base
+bids_stem = f"sub-{SUB_LABEL}_ses-{SES_LABEL}_task-{TASK_LABEL}_run-{RUN_LABEL}"  # Set bids_stem
+bids_base = bids_stem + "_beh"  # Set bids_base
 csvfile  = os.path.join(outdir, bids_base + ".csv")  # Set csvfile
 xlsxfile = os.path.join(outdir, bids_base + ".xlsx")  # Set xlsxfile
+marker_journal.open(os.path.join(outdir, bids_stem + "_markers.jsonl"))  # Local copy of every LSL marker
 
 # (Optional) keep a timestamped backup copy inside the same folder
 timestamp = time.strftime("%Y%m%d-%H%M%S")  # Set timestamp
@@ -685,9 +1438,6 @@ writer = csv.DictWriter(
                 "run",
                 "task",
                 "subject_id",
-                "name",
-                "high/low",
-                "condition",
                 "block",
         "trial",
         "colour",
@@ -716,35 +1466,7 @@ writer = csv.DictWriter(
         "collect_latency_from_ready",
         "collect_latency_from_trial_start",
         "pump_latencies_json",
-        "pump_times_json",
-        "baseline_mu",
-        "baseline_sigma",
-        "baseline_n",
-        "rest_pre_eo_theta_mean",
-        "rest_pre_eo_theta_std",
-        "rest_pre_eo_z_mean",
-        "rest_pre_eo_z_std",
-        "rest_pre_eo_n",
-        "rest_pre_ec_theta_mean",
-        "rest_pre_ec_theta_std",
-        "rest_pre_ec_z_mean",
-        "rest_pre_ec_z_std",
-        "rest_pre_ec_n",
-        "rest_pre_conc_theta_mean",
-        "rest_pre_conc_theta_std",
-        "rest_pre_conc_z_mean",
-        "rest_pre_conc_z_std",
-        "rest_pre_conc_n",
-        "rest_post_eo_theta_mean",
-        "rest_post_eo_theta_std",
-        "rest_post_eo_z_mean",
-        "rest_post_eo_z_std",
-        "rest_post_eo_n",
-        "rest_post_ec_theta_mean",
-        "rest_post_ec_theta_std",
-        "rest_post_ec_z_mean",
-        "rest_post_ec_z_std",
-        "rest_post_ec_n"  # Execute statement
+        "pump_times_json",  # session constants (manifest, baseline, rest) → <stem>_beh.json
     ],
 )
 writer.writeheader()  # Execute statement
@@ -752,6 +1474,108 @@ writer.writeheader()  # Execute statement
 # Keep rows in memory for optional XLSX export
 FIELDNAMES = list(writer.fieldnames)  # Set FIELDNAMES
 rows_buffer = []  # each element is a dict row written to CSV
+pump_log = PumpEventLog((PRACTICE_TRIALS + N_TRIALS) * PUMPS_MAX)  # every pump of the session, recorded at the press
+pump_log.open(os.path.join(outdir, bids_stem + "_pumps.bin"))  # appended after each trial (bart_beh.load_pump_events)
+
+# ----------------------------------------------------------------------
+# BACKGROUND TRIAL-ROW WRITER
+# NOTE: run_trial only enqueues its row; writerow + flush + fsync run on a worker thread.
+# wait_durable() is called before the next BART_TRIAL_START so every finished trial is on disk
+# before a new one begins (normally a no-op: the write completes during the ITI).
+# ----------------------------------------------------------------------
+
+class TrialWriter:
+    """Serialise and persist trial rows on a background thread, with write-latency metrics."""
+
+    def __init__(self, fh, dict_writer):
+        self._fh = fh
+        self._writer = dict_writer
+        self._q = queue.Queue()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.submitted = 0  # rows queued
+        self.durable = 0    # rows written + flushed + fsync'd
+        self.errors = 0
+        self.write_max = 0.0    # s, writerow → fsync
+        self.latency_sum = 0.0  # s, submit → durable
+        self.latency_max = 0.0
+        self.stalls = 0         # wait_durable() calls that actually had to wait
+        self.stall_max = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="TrialWriter", daemon=True)
+        self._thread.start()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, row):
+        """Queue one row dict (do not mutate it afterwards)."""
+        with self._cond:
+            self.submitted += 1
+        if not self.running():
+            self._write(row, time.perf_counter())  # no thread (not started / stopped): write inline
+            return
+        self._q.put((row, time.perf_counter()))
+
+    def _write(self, row, t_submit):
+        t0 = time.perf_counter()
+        try:
+            self._writer.writerow(row)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        except Exception as e:
+            self.errors += 1
+            print("⚠️ Trial row write failed:", e)
+        t1 = time.perf_counter()
+        self.write_max = max(self.write_max, t1 - t0)
+        self.latency_sum += t1 - t_submit
+        self.latency_max = max(self.latency_max, t1 - t_submit)
+        with self._cond:
+            self.durable += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def wait_durable(self, timeout=5.0):
+        """Block until every submitted row is on disk (or timeout); returns True when caught up."""
+        with self._cond:
+            if self.durable >= self.submitted:
+                return True
+            t0 = time.perf_counter()
+            ok = self._cond.wait_for(lambda: self.durable >= self.submitted or not self.running(), timeout)
+            waited = time.perf_counter() - t0
+        self.stalls += 1
+        self.stall_max = max(self.stall_max, waited)
+        if not ok:
+            print(f"⚠️ Trial writer behind by {self.submitted - self.durable} row(s) after {timeout:.1f}s")
+        return ok
+
+    def close(self, timeout=5.0):
+        """Drain the queue, stop the thread, close the CSV and print the metrics."""
+        if self.running():
+            self._q.put(None)
+            self._thread.join(timeout)
+        try:
+            self._fh.flush()
+            self._fh.close()
+        except Exception:
+            pass
+        print(self.report())
+
+    def report(self):
+        n = max(1, self.durable)
+        return (f"[CSV] rows={self.durable}/{self.submitted} errors={self.errors} "
+                f"latency mean={1000.0 * self.latency_sum / n:.1f}ms max={1000.0 * self.latency_max:.1f}ms "
+                f"write max={1000.0 * self.write_max:.1f}ms stalls={self.stalls} (max {1000.0 * self.stall_max:.1f}ms)")
+
+trial_writer = TrialWriter(f, writer)  # Set trial_writer
+trial_writer.start()  # Execute statement
 
 def _safe_str(v):  # Define function _safe_str
     """Convert values to something Excel/openpyxl can write.  # Start/continue docstring
@@ -796,8 +1620,12 @@ def _safe_str(v):  # Define function _safe_str
     # fall back
     return v  # Return value from function
 
-def write_xlsx(xlsx_path, rows, fieldnames):  # Define function write_xlsx
-    """Write trial-level rows + a small summary sheet to an .xlsx file."""  # Start/continue docstring
+def write_xlsx(xlsx_path, rows, fieldnames, pump_rows=None, frame_rows=None):  # Define function write_xlsx
+    """Write trial-level rows + a small summary sheet to an .xlsx file.
+
+    pump_rows: per-pump dicts (bart_beh.pump_event_rows) → 'pumps' sheet.
+    frame_rows: optional per-trial FrameProfiler summaries → 'frames' sheet.
+    """  # Start/continue docstring
     try:  # Begin protected block (handle errors)
         from openpyxl import Workbook  # Import dependency
     except Exception as e:  # Handle an error case
@@ -815,143 +1643,37 @@ def write_xlsx(xlsx_path, rows, fieldnames):  # Define function write_xlsx
     for r in rows:  # Loop over items
         ws.append([_safe_str(r.get(k, "")) for k in fieldnames])  # Execute statement
 
-    # Summary sheet (per block)
+    # Summary sheet (per block; bart_summary is shared with the Behavior notebook)
     try:  # Begin protected block (handle errors)
         ws2 = wb.create_sheet("summary")  # Set ws2
-        ws2.append(["block",
-                    "n_trials",
-                    "explosion_frequency",
-                    "mean_adjusted_pumps",
-                    "mean_pump_latency",
-                    "median_pump_latency",
-                    "final_total_earnings"])  # Execute statement
-        blocks = {}  # Set blocks
-        for r in rows:  # Loop over items
-            b = r.get("block", "")  # Set b
-            blocks.setdefault(b, []).append(r)  # Execute statement
-
-        for b, rs in blocks.items():  # Loop over items
-            n = len(rs)  # Set n
-            exploded_vals = [int(r.get("exploded_int", 0) or 0) for r in rs]  # Set exploded_vals
-            explosion_freq = (sum(exploded_vals) / n) if n else ""  # Set explosion_freq
-
-            adj = []  # Set adj
-            for r in rs:  # Loop over items
-                ap = r.get("adjusted_pumps_trial", "")  # Set ap
-                if ap == "" or ap is None:  # Conditional branch
-                    continue  # Skip to next loop iteration
-                try:  # Begin protected block (handle errors)
-                    adj.append(float(ap))  # Execute statement
-                except Exception:  # Handle an error case
-                    pass  # No-op placeholder
-            mean_adj = (sum(adj) / len(adj)) if adj else ""  # Set mean_adj
-
-            lat_mean = []  # Set lat_mean
-            lat_med = []  # Set lat_med
-            for r in rs:  # Loop over items
-                v1 = r.get("pump_latency_mean", "")  # Set v1
-                v2 = r.get("pump_latency_median", "")  # Set v2
-                try:  # Begin protected block (handle errors)
-                    if v1 != "" and v1 is not None:  # Conditional branch
-                        lat_mean.append(float(v1))  # Execute statement
-                except Exception:  # Handle an error case
-                    pass  # No-op placeholder
-                try:  # Begin protected block (handle errors)
-                    if v2 != "" and v2 is not None:  # Conditional branch
-                        lat_med.append(float(v2))  # Execute statement
-                except Exception:  # Handle an error case
-                    pass  # No-op placeholder
-
-            mean_lat = (sum(lat_mean) / len(lat_mean)) if lat_mean else ""  # Set mean_lat
-            # median across trial medians
-            if lat_med:  # Conditional branch
-                lat_med_sorted = sorted(lat_med)  # Set lat_med_sorted
-                mid = len(lat_med_sorted)//2  # Set mid
-                median_lat = (lat_med_sorted[mid] if len(lat_med_sorted)%2==1  # Set median_lat
-                              else (lat_med_sorted[mid-1]+lat_med_sorted[mid])/2.0)  # Call else()
-            else:  # Fallback branch
-                median_lat = ""  # Set median_lat
-
-            # final total earnings: last row's total for that block
-            final_total = ""  # Set final_total
-            try:  # Begin protected block (handle errors)
-                final_total = rs[-1].get("total_earnings", "")  # Set final_total
-            except Exception:  # Handle an error case
-                pass  # No-op placeholder
-
-            ws2.append([b, n, explosion_freq, mean_adj, mean_lat, median_lat, final_total])  # Execute statement
+        summary_header = ["block", *SUMMARY_COLUMNS]  # Set summary_header
+        ws2.append(summary_header)  # Execute statement
+        for r in summary_rows(summarize(rows, by=("block",))):  # Loop over items
+            ws2.append([r[k] for k in summary_header])  # Execute statement
     except Exception as e:  # Handle an error case
         print("⚠️ Could not write summary sheet:", e)  # Print debug/status message
 
 
     # ---------------- Pump-level sheet (one row per pump) ----------------
     try:  # Begin protected block (handle errors)
-        import json as _json  # Import dependency
         ws_p = wb.create_sheet("pumps")  # Set ws_p
-        pump_header = [
-            "block", "trial",
-            "pump_number",
-            "pump_latency_sec",
-            "pump_time_sec",
-            "exploded_int",
-            "collected",
-            "explosion_point",
-            "trial_value",
-            "trial_earnings",
-            "total_earnings",
-            "nf_source",
-            "z_used",
-            "nf_color",
-        ]
-        ws_p.append(pump_header)  # Execute statement
-
-        for r in rows:  # Loop over items
-            block = r.get("block", "")  # Set block
-            trial = r.get("trial", "")  # Set trial
-            exploded_int = int(r.get("exploded_int", 0) or 0)  # Set exploded_int
-            collected = int(r.get("collected", 0) or 0)  # Set collected
-            exp_point = r.get("explosion_point", "")  # Set exp_point
-            trial_value = r.get("trial_value", "")  # Set trial_value
-            trial_earn = r.get("trial_earnings", "")  # Set trial_earn
-            total_earn = r.get("total_earnings", "")  # Set total_earn
-            nf_source = r.get("nf_source", "")  # Set nf_source
-            z_used = r.get("z_used", "")  # Set z_used
-            nf_color = r.get("nf_color", "")  # Set nf_color
-
-            lat_j = r.get("pump_latencies_json", "") or ""  # Set lat_j
-            t_j   = r.get("pump_times_json", "") or ""  # Set t_j
-
-            try:  # Begin protected block (handle errors)
-                lat_list = _json.loads(lat_j) if lat_j else []  # Set lat_list
-            except Exception:  # Handle an error case
-                lat_list = []  # Set lat_list
-            try:  # Begin protected block (handle errors)
-                t_list = _json.loads(t_j) if t_j else []  # Set t_list
-            except Exception:  # Handle an error case
-                t_list = []  # Set t_list
-
-            n_p = max(len(lat_list), len(t_list))  # Set n_p
-            for i in range(n_p):  # Loop over items
-                lat = lat_list[i] if i < len(lat_list) else ""  # Set lat
-                tt  = t_list[i] if i < len(t_list) else ""  # Set tt
-                ws_p.append([
-                    block, trial,
-                    i + 1,
-                    lat,
-                    tt,
-                    exploded_int,
-                    collected,
-                    exp_point,
-                    trial_value,
-                    trial_earn,
-                    total_earn,
-                    nf_source,
-                    z_used,
-                    nf_color,
-                ])
+        ws_p.append(list(PUMP_COLUMNS))  # Execute statement
+        for r in (pump_rows or []):  # Loop over items
+            ws_p.append([r.get(k, "") for k in PUMP_COLUMNS])  # Execute statement
     except Exception as e:  # Handle an error case
         print("⚠️ Could not write pump-level sheet:", e)  # Print debug/status message
 
+    # ---------------- Frame timing sheet (FRAME_PROFILE only) ----------------
+    if frame_rows:  # Conditional branch
+        try:  # Begin protected block (handle errors)
+            ws_f = wb.create_sheet("frames")  # Set ws_f
+            frame_header = list(frame_rows[0].keys())  # Set frame_header
+            ws_f.append(frame_header)  # Execute statement
+            for r in frame_rows:  # Loop over items
+                ws_f.append([_safe_str(r.get(k, "")) for k in frame_header])  # Execute statement
+        except Exception as e:  # Handle an error case
+            print("⚠️ Could not write frame timing sheet:", e)  # Print debug/status message
+
     try:  # Begin protected block (handle errors)
         wb.save(xlsx_path)  # Execute statement
         print("✅ XLSX saved:", xlsx_path)  # Print debug/status message
@@ -993,6 +1715,89 @@ SHAM_THETA = (
 )
 
 
+# ----------------------------------------------------------------------
+# EEG RING BUFFER + BAND-POWER ENGINE
+# NOTE: The raw EEG window lives in a preallocated circular buffer and the band
+#       power is a projection onto a cached DFT basis, so an NF update neither
+#       copies the whole window (np.roll) nor computes every rfft bin.
+# ----------------------------------------------------------------------
+
+from nf_spectral import RingBuffer, BandPowerDFT, TaperedBandPower, SlidingDFT  # Task/nf_spectral.py (tested by test_nf_spectral.py)
+
+
+class NFFeaturePipeline:
+    """(channels x bands) spectral power matrix plus a configurable NF metric.
+
+    One batched pass per update: new samples for all feature channels go into
+    the ring, the engine returns every band for every channel, and the metric
+    is a reduction over that matrix (see NF_METRIC).
+    """
+
+    def __init__(self, n_stream_channels, bands=None, channels=None, metric=None, metric_channels=None,
+                 method=None, n=WIN_SAMPLES, fs=FS):
+        bands = dict(NF_BANDS if bands is None else bands)
+        self.band_names = list(bands.keys())
+        chans = NF_FEATURE_CHANNELS if channels is None else channels
+        self.channels = list(range(int(n_stream_channels))) if chans is None else [int(c) for c in chans]
+        self.n_stream_channels = int(n_stream_channels)
+        self.ring = RingBuffer(n, len(self.channels))
+        band_ranges = [bands[b] for b in self.band_names]
+
+        method = str(NF_SPECTRAL_METHOD if method is None else method).lower()
+        self.method = method
+        if method == "sdft":
+            self.engine = SlidingDFT(n, fs, band_ranges, len(self.channels))
+        elif method in ("welch", "multitaper"):
+            self.engine = TaperedBandPower(n, fs, band_ranges, len(self.channels), mode=method,
+                                           welch_seg_s=NF_WELCH_SEG_S, welch_overlap=NF_WELCH_OVERLAP,
+                                           mt_nw=NF_MT_NW, mt_tapers=NF_MT_TAPERS)
+        else:
+            self.engine = BandPowerDFT(n, fs, band_ranges, len(self.channels))
+
+        self.power = np.full((len(self.channels), len(self.band_names)), np.nan)  # channels x bands
+        self._set_metric(NF_METRIC if metric is None else metric,
+                         NF_METRIC_CHANNELS if metric_channels is None else metric_channels)
+
+    def _set_metric(self, metric, metric_channels):
+        """Parse 'band' or 'bandA/bandB' (or a callable) into precomputed indices."""
+        self._metric_fn = metric if callable(metric) else None
+        self.metric_name = getattr(metric, "__name__", "custom") if callable(metric) else str(metric)
+        mchans = self.channels if metric_channels is None else list(metric_channels)
+        self._metric_rows = np.array([self.channels.index(c) for c in mchans if c in self.channels], dtype=int)
+        if self._metric_fn is not None:
+            return
+        parts = [p.strip() for p in str(metric).split("/")]
+        for p in parts:
+            if p not in self.band_names:
+                raise ValueError(f"NF_METRIC band '{p}' not in NF_BANDS {self.band_names}")
+        self._metric_num = self.band_names.index(parts[0])
+        self._metric_den = self.band_names.index(parts[1]) if len(parts) > 1 else None
+
+    def update(self, block):
+        """Push (m, n_stream_channels) samples; return the NF metric (or None)."""
+        bp = self.engine.update(self.ring, block[:, self.channels])
+        self.power[:] = bp.T
+        return self.metric()
+
+    def metric(self):
+        if self._metric_fn is not None:
+            v = self._metric_fn(self.power, self.band_names, self.channels)
+            return None if v is None else float(v)
+        if not len(self._metric_rows):
+            return None
+        num = float(np.mean(self.power[self._metric_rows, self._metric_num]))
+        if self._metric_den is None:
+            return num if np.isfinite(num) else None
+        den = float(np.mean(self.power[self._metric_rows, self._metric_den]))
+        if not np.isfinite(num) or not np.isfinite(den) or den <= 0.0:
+            return None
+        return num / den
+
+    def feature_names(self):
+        """Column names matching power.ravel() (channel-major)."""
+        return [f"ch{c + 1:02d}_{b}" for c in self.channels for b in self.band_names]
+
+
 # ----------------------------------------------------------------------
 # NF CONNECTOR
 # NOTE: Neurofeedback engine: connects to EEG (or sim/sham), computes theta power, builds baseline, outputs z-score, and keeps history for the HUD graph.
@@ -1011,14 +1816,28 @@ class NFConnector:
     a *direction* sign so that 'better' always maps to positive z.
 
     Notes:
-    - In real NF mode, we only receive z (unless you also stream theta). We still
-      allow the task to run; rest-theta summaries may be blank if no theta is available.
+    - In real NF mode, we only receive z (unless NF_LOCAL_THETA is on, in which case
+      theta is computed here from the raw EEG stream). We still allow the task to run;
+      rest-theta summaries may be blank if no theta is available.
     """
 
     def __init__(self):
         self.inlet = None
         self.connected = False
 
+        # Raw EEG (only used when NF_LOCAL_THETA is on): spectral feature pipeline + optional log
+        self.eeg_inlet = None
+        self.features = None  # NFFeaturePipeline, built once the stream's channel count is known
+        self._last_theta_update = 0.0
+        self._feature_log_path = None
+        self._feature_log = None
+
+        # Background acquisition (EEG/LSL mode): the thread publishes (seq, z, t)
+        self._acq_thread = None
+        self._acq_stop = threading.Event()
+        self._acq_latest = None
+        self._acq_seen = 0
+
         # Latest values
         self.last_z = 0.0
         self.ema = 0.0  # EMA-smoothed z
@@ -1043,22 +1862,31 @@ class NFConnector:
         # SHAM state
         self._sham_idx = 0
         # --- debug histories for HUD/graph (safe on all machines) ---
-        self.history_z = []      # rolling z-score history
-        self.history_theta = []  # rolling theta (or proxy) history
-        self._hist_maxlen = 300  # ~30s at 10Hz (adjust as needed)
+        self.history_len = NF_HISTORY_LEN
+        self.history_z = RingBuffer(self.history_len)      # rolling z-score history
+        self.history_theta = RingBuffer(self.history_len)  # rolling theta (or proxy) history
         self.warning_text = ''  # optional HUD warning line
 
-    def try_connect(self, attempts=10, sleep_s=0.5):
-        """Try to connect to LSL 'NF_Z'. If SIM/SHAM is enabled, no connection is needed."""
+    def try_connect(self, attempts=10, sleep_s=0.5, resolved=None):
+        """Try to connect to LSL 'NF_Z'. If SIM/SHAM is enabled, no connection is needed.
+
+        resolved: {"nf": [...], "eeg": [...]} from _resolve_lsl_streams(); used instead of
+        resolving again (a single attempt).
+        """
         if SIMULATE_NF or SHAM_NF:
             self.connected = True
             return True
         if not LSL_OK:
             return False
+        if NF_LOCAL_THETA and self.eeg_inlet is None:
+            self._connect_eeg((resolved or {}).get("eeg"))
         for _ in range(attempts):
-            streams = resolve_byprop('name', 'NF_Z', timeout=1.0)
-            if not streams:
-                streams = resolve_byprop('type', 'NF', timeout=1.0)
+            if resolved is not None:
+                streams = resolved.get("nf") or []
+            else:
+                streams = resolve_byprop('name', 'NF_Z', timeout=1.0)
+                if not streams:
+                    streams = resolve_byprop('type', 'NF', timeout=1.0)
             if streams:
                 try:
                     self.inlet = StreamInlet(streams[0], max_buflen=120, recover=True)
@@ -1067,9 +1895,150 @@ class NFConnector:
                 except Exception:
                     self.inlet = None
                     self.connected = False
+            if resolved is not None:
+                break
             core.wait(sleep_s)
         return False
 
+    # ------------------------------------------------------------------
+    # Background acquisition (EEG/LSL mode)
+    # ------------------------------------------------------------------
+    def start_acquisition(self):
+        """Start the acquisition thread so LSL pulls never run inside the frame loop."""
+        if SIMULATE_NF or SHAM_NF or (not LSL_OK) or (not NF_ACQ_THREAD):
+            return False
+        if self.acquisition_running():
+            return True
+        self._acq_stop.clear()
+        self._acq_thread = threading.Thread(target=self._acq_loop, name="NFAcquisition", daemon=True)
+        self._acq_thread.start()
+        return True
+
+    def stop_acquisition(self, timeout=1.0):
+        """Signal the acquisition thread to exit and wait briefly for it."""
+        self._acq_stop.set()
+        t = self._acq_thread
+        if t is not None and t.is_alive() and t is not threading.current_thread():
+            t.join(timeout)
+        self._acq_thread = None
+
+    def acquisition_running(self):
+        return self._acq_thread is not None and self._acq_thread.is_alive()
+
+    def _acq_resolve(self):
+        """Non-blocking-for-the-UI version of try_connect (runs on the acquisition thread)."""
+        if NF_LOCAL_THETA and self.eeg_inlet is None:
+            self._connect_eeg()
+        try:
+            streams = resolve_byprop('name', 'NF_Z', timeout=1.0)
+            if not streams:
+                streams = resolve_byprop('type', 'NF', timeout=1.0)
+            if streams:
+                self.inlet = StreamInlet(streams[0], max_buflen=120, recover=True)
+                self.connected = True
+        except Exception:
+            self.inlet = None
+
+    def _acq_loop(self):
+        """Drain the NF_Z (and raw EEG) inlets and publish a smoothed z every NF_UPDATE_INTERVAL."""
+        interval = float(NF_UPDATE_INTERVAL)
+        next_t = time.perf_counter()
+        next_resolve = 0.0
+        seq = 0
+        ema = float(self.ema) if self.ema is not None else None
+        while not self._acq_stop.is_set():
+            now = time.perf_counter()
+            if now < next_t:
+                self._acq_stop.wait(next_t - now)
+                continue
+            next_t += interval
+            if next_t < now:  # fell behind (e.g. resolve); keep cadence without bursting
+                next_t = now + interval
+
+            if (self.inlet is None or (NF_LOCAL_THETA and self.eeg_inlet is None)) and now >= next_resolve:
+                next_resolve = now + 2.0
+                self._acq_resolve()
+
+            z_raw = None
+            if self.inlet is not None:
+                try:
+                    chunk, _ts = self.inlet.pull_chunk(timeout=0.0, max_samples=1024)
+                    if chunk:
+                        z_raw = float(chunk[-1][0])
+                except Exception:
+                    z_raw = None
+
+            theta = None
+            if NF_LOCAL_THETA:
+                try:
+                    theta = self._compute_theta_power()
+                except Exception:
+                    theta = None
+
+            if z_raw is None and theta is None:
+                continue
+            if z_raw is not None:
+                ema = z_raw if ema is None else float(Z_ALPHA) * z_raw + (1.0 - float(Z_ALPHA)) * ema
+            seq += 1
+            # single tuple assignment = atomic publish; readers never see a half-written update
+            self._acq_latest = (seq, ema if ema is not None else 0.0, core.getTime())
+
+    def _connect_eeg(self, streams=None):
+        """Open the raw EEG inlet and allocate the theta ring buffer/engine once."""
+        try:
+            if not streams:
+                streams = resolve_byprop('name', EEG_STREAM_NAME, timeout=1.0)
+            if not streams:
+                return False
+            self.eeg_inlet = StreamInlet(streams[0], max_buflen=120, recover=True)
+        except Exception as e:
+            print("⚠️ EEG inlet failed:", e)
+            self.eeg_inlet = None
+            return False
+        try:
+            n_ch = int(self.eeg_inlet.info().channel_count())
+        except Exception:
+            n_ch = max(FRONTAL_IDXS) + 1
+        try:
+            self.features = NFFeaturePipeline(n_ch)
+        except Exception as e:
+            print("⚠️ NF feature pipeline setup failed:", e)
+            self.features = None
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # Feature log (every channel x band power, one row per update)
+    # ------------------------------------------------------------------
+    def open_feature_log(self, path):
+        """Remember where to log features; the file is created on the first row."""
+        self._feature_log_path = path if NF_LOG_FEATURES else None
+
+    def _log_features(self, t, metric):
+        if not self._feature_log_path or self.features is None:
+            return
+        try:
+            if self._feature_log is None:
+                self._feature_log = open(self._feature_log_path, "w", newline="")
+                self._feature_log.write(",".join(["time", "metric", "z"] + self.features.feature_names()) + "\n")
+            vals = self.features.power.ravel()
+            self._feature_log.write(
+                f"{t:.6f},{'' if metric is None else f'{metric:.6g}'},{float(self.last_z):.4f},"
+                + ",".join(f"{v:.6g}" for v in vals) + "\n"
+            )
+        except Exception as e:
+            print("⚠️ NF feature log write failed:", e)
+            self._feature_log_path = None
+
+    def close_feature_log(self):
+        fh, self._feature_log = self._feature_log, None
+        if fh is not None:
+            try:
+                fh.flush()
+                fh.close()
+            except Exception:
+                pass
+
     def _sim_step(self):
         """One step of simulated theta (random-walk with gentle mean reversion)."""
         # Mean-reverting random walk around 0
@@ -1221,26 +2190,6 @@ class NFConnector:
             dt = max(1e-3, float(now_t - self._last_pull_t))
         self._last_pull_t = now_t
 
-        # Make sure histories exist for HUD/graph
-        if not hasattr(self, "history_z"):
-            self.history_z = []
-        if not hasattr(self, "history_theta"):
-            self.history_theta = []
-        if not hasattr(self, "_hist_maxlen"):
-            self._hist_maxlen = 300
-
-        def _push_hist(z, theta=None):
-            try:
-                self.history_z.append(float(z))
-                if theta is not None:
-                    self.history_theta.append(float(theta))
-                if len(self.history_z) > self._hist_maxlen:
-                    self.history_z = self.history_z[-self._hist_maxlen:]
-                if len(self.history_theta) > self._hist_maxlen:
-                    self.history_theta = self.history_theta[-self._hist_maxlen:]
-            except Exception:
-                pass
-
         # ---------- SHAM ----------
         if SHAM_NF:
             # Piecewise "streak" sham (NOT sinusoidal): holds LOW/MID/HIGH for sampled durations.
@@ -1249,13 +2198,13 @@ class NFConnector:
             # Update EMA and histories for HUD/graph
             self.last_z = float(z)
             self.ema = Z_ALPHA * self.last_z + (1.0 - Z_ALPHA) * self.ema
-            _push_hist(self.ema, self.last_theta)
+            self._push_hist(self.ema, self.last_theta)
             return self.ema
 
         # ---------- EEG/LSL ----------
 
         if (not self.connected) or (self.inlet is None):
-            _push_hist(self.ema)
+            self._push_hist(self.ema)
             return self.ema
 
         chunk = None
@@ -1271,25 +2220,19 @@ class NFConnector:
                 pass
 
         self.ema = Z_ALPHA * float(self.last_z) + (1.0 - Z_ALPHA) * self.ema
-        _push_hist(self.ema)
+        self._push_hist(self.ema)
         return self.ema
 
     def _push_hist(self, z, theta=None):
-        """Store rolling history for debug HUD/graph; safe if lists are missing."""
+        """Store rolling history for debug HUD/graph (O(1) ring push; rings created if missing)."""
         try:
-            if not hasattr(self, 'history_z'):
-                self.history_z = []
-            if not hasattr(self, 'history_theta'):
-                self.history_theta = []
-            if not hasattr(self, '_hist_maxlen'):
-                self._hist_maxlen = 300
-            self.history_z.append(float(z))
+            if not isinstance(getattr(self, 'history_z', None), RingBuffer):
+                self.history_len = int(getattr(self, 'history_len', NF_HISTORY_LEN))
+                self.history_z = RingBuffer(self.history_len)
+                self.history_theta = RingBuffer(self.history_len)
+            self.history_z.push(z)
             if theta is not None:
-                self.history_theta.append(float(theta))
-            if len(self.history_z) > self._hist_maxlen:
-                self.history_z = self.history_z[-self._hist_maxlen:]
-            if len(self.history_theta) > self._hist_maxlen:
-                self.history_theta = self.history_theta[-self._hist_maxlen:]
+                self.history_theta.push(theta)
         except Exception:
             pass
 
@@ -1341,48 +2284,31 @@ class NFConnector:
             return self.last_theta  # Return value from function
 
         # Real EEG LSL mode
-        if not (self.connected and self.eeg_inlet and self.buffer is not None):  # Conditional branch
+        if self.eeg_inlet is None or self.features is None:  # Conditional branch
             return None  # Return value from function
 
-        chunk, _ = self.eeg_inlet.pull_chunk(timeout=0.0, max_samples=WIN_SAMPLES)  # Execute statement
+        try:  # Begin protected block (handle errors)
+            chunk, _ = self.eeg_inlet.pull_chunk(timeout=0.0, max_samples=WIN_SAMPLES)  # Execute statement
+        except Exception:  # Handle an error case
+            return None  # Return value from function
         if not chunk:  # Conditional branch
             return None  # Return value from function
 
-        arr = np.asarray(chunk)  # Set arr
-        if arr.ndim != 2 or arr.shape[1] <= max(FRONTAL_IDXS):  # Conditional branch
+        arr = np.asarray(chunk, dtype=float)  # Set arr
+        if arr.ndim != 2 or arr.shape[1] != self.features.n_stream_channels:  # Conditional branch
             return None  # Return value from function
 
-        n_new = min(arr.shape[0], WIN_SAMPLES)  # Set n_new
-        new_data = arr[-n_new:, FRONTAL_IDXS]  # Set new_data
-
-        self.buffer = np.roll(self.buffer, -n_new, axis=0)  # Execute statement
-        self.buffer[-n_new:, :] = new_data  # Execute statement
-
-        data = self.buffer.T.astype(float)  # Set data
-        data -= data.mean(axis=1, keepdims=True)  # Execute statement
-
-        fft_vals = np.fft.rfft(data, axis=1)  # Set fft_vals
-        freqs = np.fft.rfftfreq(data.shape[1], 1.0 / FS)  # Set freqs
-
-        mask = (freqs >= THETA_BAND[0]) & (freqs <= THETA_BAND[1])  # Set mask
-        if not np.any(mask):  # Conditional branch
+        # One batched pass: channels x bands matrix, then the NF_METRIC reduction (theta by default)
+        theta_power = self.features.update(arr)  # Set theta_power
+        now = core.getTime()  # Set now
+        self._log_features(now, theta_power)  # Execute statement
+        if theta_power is None:  # Conditional branch
             return None  # Return value from function
 
-        psd = np.abs(fft_vals) ** 2  # Set psd
-        theta_power = float(psd[:, mask].mean())  # Set theta_power
-
         self.last_theta = theta_power  # Execute statement
-        self.last_theta_time = core.getTime()  # Execute statement
+        self.last_theta_time = now  # Execute statement
         return theta_power  # Return value from function
 
-    # ------------------------------------------------------------------
-    # History
-    # ------------------------------------------------------------------
-    def _append_history(self, z):  # Define function _append_history
-        self.history_z.append(float(z))  # Execute statement
-        if len(self.history_z) > self.history_len:  # Conditional branch
-            self.history_z = self.history_z[-self.history_len:]  # Execute statement
-
     # ------------------------------------------------------------------
     # Public update
     # ------------------------------------------------------------------
@@ -1394,7 +2320,7 @@ class NFConnector:
             self.try_connect(attempts=1)  # Execute statement
             if not self.connected:  # Conditional branch
                 self.last_z = 0.0  # Execute statement
-                self._append_history(self.last_z)  # Execute statement
+                self._push_hist(self.last_z)  # Execute statement
                 return self.last_z  # Return value from function
 
         # decimation
@@ -1404,7 +2330,7 @@ class NFConnector:
             theta = self._compute_theta_power()  # Set theta
 
         if theta is None:  # Conditional branch
-            self._append_history(self.last_z)  # Execute statement
+            self._push_hist(self.last_z)  # Execute statement
             return self.last_z  # Return value from function
 
         if self.baseline_active and not self.baseline_done:  # Conditional branch
@@ -1424,7 +2350,7 @@ class NFConnector:
 
         self.last_z = self.ema  # Execute statement
 
-        self._append_history(self.last_z)  # Execute statement
+        self._push_hist(self.last_z)  # Execute statement
         return self.last_z  # Return value from function
 
 
@@ -1446,20 +2372,9 @@ class NFConnector:
 # ----------------------------------------------------------------------
 
 def _nf_pull_z_safeguard(self):
-    """Return current z-score in all modes and keep history for the HUD graph."""
+    """Return current z-score in all modes; history (HUD graph) is pushed once per new NF sample."""
     now = core.getTime()
 
-    # Ensure history exists (for HUD graph)
-    if not hasattr(self, 'history_z'):
-        self.history_z = []
-    if not hasattr(self, 'history_len'):
-        self.history_len = 240
-
-    def _append(zval: float):
-        self.history_z.append(float(zval))
-        if len(self.history_z) > int(self.history_len):
-            self.history_z[:] = self.history_z[-int(self.history_len):]
-
     # ---------------- SHAM MODE ----------------
     if SHAM_NF:
         if not hasattr(self, 'last_update_time'):
@@ -1470,9 +2385,8 @@ def _nf_pull_z_safeguard(self):
             idx = int(getattr(self, 'sham_index', 0)) % len(pattern)
             self.sham_index = idx + 1
             self.last_z = float(pattern[idx])
-        z = float(getattr(self, 'last_z', 0.0))
-        _append(z)
-        return z
+            self._push_hist(self.last_z)
+        return float(getattr(self, 'last_z', 0.0))
 
     # ---------------- SIM MODE ----------------
     if SIMULATE_NF:
@@ -1494,19 +2408,35 @@ def _nf_pull_z_safeguard(self):
             self.sim_z += random.gauss(0.0, 0.08)
             self.sim_z = max(-3.0, min(3.0, self.sim_z))
             self.last_z = float(self.sim_z)
+            self._push_hist(self.last_z)
 
-        z = float(getattr(self, 'last_z', 0.0))
-        _append(z)
-        return z
+        return float(getattr(self, 'last_z', 0.0))
 
     # ---------------- EEG/LSL MODE ----------------
-    # Read z directly from NF_Z stream (do NOT compute theta here)
+    # Acquisition thread running: only read the latest published value (no LSL calls here)
+    if self.acquisition_running():
+        snap = self._acq_latest
+        if snap is not None and snap[0] != self._acq_seen:
+            self._acq_seen = snap[0]
+            self.ema = float(snap[1])
+            self.last_z = float(snap[1])
+            self._push_hist(self.last_z)
+        return float(getattr(self, 'last_z', 0.0))
+
+    # Read z directly from NF_Z stream (theta is only computed here if NF_LOCAL_THETA)
     if not getattr(self, 'connected', False):
         try:
             self.try_connect(attempts=1)
         except Exception:
             pass
 
+    if NF_LOCAL_THETA and (now - float(getattr(self, '_last_theta_update', 0.0))) >= float(NF_UPDATE_INTERVAL):
+        self._last_theta_update = now
+        try:
+            self._compute_theta_power()
+        except Exception:
+            pass
+
     z_raw = None
     if getattr(self, 'inlet', None) is not None:
         try:
@@ -1517,9 +2447,7 @@ def _nf_pull_z_safeguard(self):
             z_raw = None
 
     if z_raw is None:
-        z = float(getattr(self, 'last_z', 0.0))
-        _append(z)
-        return z
+        return float(getattr(self, 'last_z', 0.0))
 
     # EMA smoothing
     ema = getattr(self, 'ema', None)
@@ -1531,7 +2459,7 @@ def _nf_pull_z_safeguard(self):
     self.last_z = float(ema)
 
     z = float(self.last_z)
-    _append(z)
+    self._push_hist(z)
     return z
 
 
@@ -1741,24 +2669,40 @@ def float_up(y0, y1, t, dur):  # Define function float_up
 # DEBUG GRAPH DRAWING
 # ----------------------------------------------------------------------
 
+# Persistent vertex buffer for the debug graph: x is recomputed only when the
+# number of points changes, y is written in place, and graph_line.vertices is only
+# reassigned when new NF samples have been pushed to the history ring.
+_graph_verts = None   # float32 (history_len, 2)
+_graph_n = -1         # number of points whose x coordinates are in _graph_verts
+_graph_count = -1     # history_z.count at the last vertex update
+
+
 def draw_debug_graph(nf: NFConnector):  # Define function draw_debug_graph
+    global _graph_verts, _graph_n, _graph_count
     if not DEBUG_GRAPH or not SHOW_NF_HUD:  # Conditional branch
         return  # Return value from function
-    if not getattr(nf, 'history_z', []):  # Conditional branch
+    hist = getattr(nf, 'history_z', None)  # Set hist
+    if hist is None or len(hist) < 2:  # Conditional branch
         return  # Return value from function
 
     graph_frame.draw()  # Execute statement
     graph_zero.draw()  # Execute statement
 
-    z_arr = np.asarray(getattr(nf, 'history_z', []), dtype=float)  # Set z_arr
-    n = len(z_arr)  # Set n
-    xs = np.linspace(-GRAPH_WIDTH / 2, GRAPH_WIDTH / 2, n)  # Set xs
-
-    z_clip = np.clip(z_arr, -GRAPH_Z_RANGE, GRAPH_Z_RANGE)  # Set z_clip
-    ys = (z_clip / GRAPH_Z_RANGE) * (GRAPH_HEIGHT / 2)  # Set ys
-
-    verts = list(zip(xs + GRAPH_POS[0], ys + GRAPH_POS[1]))  # Set verts
-    graph_line.vertices = verts  # Execute statement
+    if hist.count != _graph_count:  # new NF samples since the last update
+        _graph_count = hist.count  # Execute statement
+        z_arr = hist.ordered()  # oldest → newest view of the ring (no copy)
+        n = len(z_arr)  # Set n
+        if _graph_verts is None or _graph_verts.shape[0] < n:  # Conditional branch
+            _graph_verts = np.zeros((hist.n, 2), dtype=np.float32)  # Set _graph_verts
+            _graph_n = -1  # Execute statement
+        if n != _graph_n:  # Conditional branch
+            _graph_verts[:n, 0] = np.linspace(-GRAPH_WIDTH / 2, GRAPH_WIDTH / 2, n) + GRAPH_POS[0]  # Execute statement
+            _graph_n = n  # Execute statement
+        ys = _graph_verts[:n, 1]  # Set ys
+        np.clip(z_arr, -GRAPH_Z_RANGE, GRAPH_Z_RANGE, out=ys)  # Execute statement
+        ys *= (GRAPH_HEIGHT / 2) / GRAPH_Z_RANGE  # Execute statement
+        ys += GRAPH_POS[1]  # Execute statement
+        graph_line.vertices = _graph_verts[:n]  # Execute statement
     graph_line.draw()  # Execute statement
 
 # ----------------------------------------------------------------------
@@ -1779,6 +2723,7 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
     last_color_update = core.getTime()  # Set last_color_update
 
     nf_cat = ""  # Set nf_cat
+    z = float("nan")  # NF not pulled yet this trial (e.g. NF connects mid-trial); pump records then carry NaN
     if nf.connected and nf_color_enabled:  # Conditional branch
         z = nf.pull_z()  # Set z
         col, cat = z_to_color(z)  # Execute statement
@@ -1856,6 +2801,7 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
     earnings = 0  # Set earnings
 
     explosion_point = draw_explosion_point_linear(PUMPS_MAX, CHANCE_NO_POP)  # Set explosion_point
+    expoint = explosion_point if explosion_point is not None else -1  # Marker field 'expoint' (-1 = no pop)
     events = [f"hazard=linear;pNoPop={CHANCE_NO_POP}"]  # Set events
 
     cool_until = 0.0  # Set cool_until
@@ -1878,6 +2824,7 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
         """Show +points overlay for a fixed duration, with eased opacity/position."""
         t0 = core.getTime()
         while True:
+            frame_profiler.mark()
             now_anim = core.getTime()
             t = now_anim - t0
             if t >= COLLECT_DUR:
@@ -1901,7 +2848,8 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             collect_text.pos = (0, yc)
             collect_text.draw()
 
-            safe_flip()
+            frame_profiler.lap("draw")
+            frame_profiler.flip()
             core.wait(0.005)
 
         # Reset opacity so next trial starts clean on all GPUs
@@ -1911,6 +2859,7 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
         """Show BOOM + loss overlay for a fixed duration, with flash behind."""
         t0 = core.getTime()
         while True:
+            frame_profiler.mark()
             now_anim = core.getTime()
             t = now_anim - t0
             if t >= BOOM_DUR:
@@ -1943,7 +2892,8 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             boom_text.draw()
             loss_text.draw()
 
-            safe_flip()
+            frame_profiler.lap("draw")
+            frame_profiler.flip()
             core.wait(0.005)
 
         # Reset
@@ -1967,19 +2917,20 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
         nf_status.draw()  # Execute statement
     if DEBUG_GRAPH and SHOW_NF_HUD:  # Conditional branch
         draw_debug_graph(nf)  # Call draw_debug_graph()
-    safe_flip()  # Call safe_flip()
-
-    send_marker(
+    trial_writer.wait_durable()  # Previous trial's row must be on disk before this trial starts
+    schedule_marker(
         "BART_TRIAL_START",
         block=block_name,
         trial=tnum,
-        expoint=(explosion_point if explosion_point is not None else -1),
+        expoint=expoint,
         nf=nf_src,
         z=(round(z_used, 3) if isinstance(z_used, (float, int)) else ""),
     )
+    frame_profiler.flip()  # Call safe_flip() (flip time logged when FRAME_PROFILE)
 
     # ---------------------- MAIN TRIAL LOOP ----------------------
     while True:  # Loop while condition holds
+        frame_profiler.mark()  # Start of frame CPU accounting (no-op unless FRAME_PROFILE)
         now = core.getTime()  # Set now
 
         # ----------------- NF update (theta + z) -----------------
@@ -2015,13 +2966,17 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             if nf_cat == "high":  # Conditional branch
                 nf_high_frames += 1  # Execute statement
 
+        frame_profiler.lap("nf")  # Execute statement
+
         # Apply any smooth balloon-color fade (ERP-friendly).  #
         # Note: we freeze color changes during explosion marker frames.  #
         if now >= freeze_color_until and not exploded and now >= boom_until:  # Guard
             update_color_fade(now)  # Update balloon.fillColor smoothly
+        frame_profiler.lap("fade")  # Execute statement
 
         # ----------------- KEYBOARD INPUT -----------------
         keys = kb.getKeys(keyList=["space", "c", "escape"], waitRelease=False, clear=True)  # Set keys
+        frame_profiler.lap("keys")  # Execute statement
 
         if any(k.name == "escape" for k in keys):  # Conditional branch
             send_marker("BART_ABORT")  # Call send_marker()
@@ -2051,8 +3006,8 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             bank += earnings
             events.append("collect")
 
-            # marker + log
-            send_marker(
+            # marker (pushed on the first collect-overlay flip) + log
+            schedule_marker(
                 "BART_COLLECT",
                 block=block_name,
                 trial=tnum,
@@ -2061,6 +3016,8 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
                 total=bank,
                 latency_from_start=collect_latency_from_trial_start,
                 latency_from_ready=collect_latency_from_ready,
+                expoint=expoint,
+                press_t=now,  # key handled (marker timestamp is the overlay flip)
             )
 
             # play overlay in a dedicated loop (robust on lab GPUs)
@@ -2070,11 +3027,11 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
 
             # end trial with fixation
             fixation.draw()
+            schedule_marker("BART_FIXATION_START", block=block_name, trial=tnum)
             safe_flip()
-            send_marker("BART_FIXATION_START", block=block_name, trial=tnum)
             core.wait(FIXATION_BASELINE)
+            schedule_marker("BART_FIXATION_END", block=block_name, trial=tnum)
             safe_flip()
-            send_marker("BART_FIXATION_END", block=block_name, trial=tnum)
             break
 
         # ----------------- PUMP (SPACE) -----------------
@@ -2098,13 +3055,16 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
 
 
                     # latency from dot-ready to this pump
-                    try:  # Begin protected block (handle errors)
-                        lat = float(now - last_ready_time)  # Set lat
-                        if lat >= 0:  # Conditional branch
-                            pump_latencies.append(lat)  # Execute statement
-                            pump_times.append(float(now - trial_start))  # Execute statement
-                    except Exception:  # Handle an error case
-                        pass  # No-op placeholder
+                    lat = float(now - last_ready_time)  # Set lat
+                    if lat >= 0:  # Conditional branch
+                        pump_latencies.append(lat)  # Execute statement
+                        pump_times.append(float(now - trial_start))  # Execute statement
+                    try:  # Every press goes to <stem>_pumps.bin, whatever its latency
+                        pump_log.record(block_name, tnum, pumps, now, now - trial_start, lat,
+                                        z=(z if (nf.connected and nf_color_enabled) else None),
+                                        color=nf_cat)  # NF state at the press
+                    except (TypeError, ValueError, OverflowError) as e:  # Bad field value only
+                        print(f"⚠️ Pump event not recorded (trial {tnum}, pump {pumps}):", e)  # Execute statement
                     # Start balloon growth animation
                     target = min(
                         balloon.radius * BALLOON_GROWTH_FACTOR + BALLOON_GROWTH_ADD,
@@ -2113,12 +3073,13 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
                     inflate_tween.start(balloon.radius, target, PUMP_ANIM_SEC)  # Execute statement
 
                     events.append(f"pump@{pumps};key=space")  # Execute statement
-                    send_marker(
+                    schedule_marker(
                         "BART_PUMP",
                         block=block_name,
                         trial=tnum,
                         pump=pumps,
                         key="space",
+                        press_t=now,  # key handled (marker timestamp is the feedback flip)
                     )
 
                     # Check whether the balloon explodes on this pump
@@ -2130,13 +3091,14 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
                             bank = 0  # Set bank
                         
                         events.append(f"explode;loss={pending_loss}")
-                        send_marker(
+                        schedule_marker(
                             "BART_EXPLODE",
                             block=block_name,
                             trial=tnum,
                             pump=pumps,
                             loss=pending_loss,
                             total=bank,
+                            expoint=expoint,
                         )
 
                         # ERP NOTE: freeze color transitions on the explosion marker frame
@@ -2148,11 +3110,11 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
 
                         # end trial with fixation
                         fixation.draw()
+                        schedule_marker("BART_FIXATION_START", block=block_name, trial=tnum)
                         safe_flip()
-                        send_marker("BART_FIXATION_START", block=block_name, trial=tnum)
                         core.wait(FIXATION_BASELINE)
+                        schedule_marker("BART_FIXATION_END", block=block_name, trial=tnum)
                         safe_flip()
-                        send_marker("BART_FIXATION_END", block=block_name, trial=tnum)
                         break
 
                     else:  # Fallback branch
@@ -2191,6 +3153,8 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
         else:  # Fallback branch
             flash_rect.opacity = 0.0  # Execute statement
 
+        frame_profiler.lap("logic")  # Execute statement
+
         # ----------------- DRAW FRAME -----------------
         # Flash overlay (drawn first so BOOM/collect text stays on top)
         if flash_rect.opacity > 0.0:
@@ -2245,26 +3209,27 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             collect_text.pos = (0, yc)  # Execute statement
             collect_text.draw()  # Execute statement
 
-        safe_flip()  # Call safe_flip()
+        frame_profiler.lap("draw")  # Execute statement
+        frame_profiler.flip()  # Call safe_flip() (flip time logged when FRAME_PROFILE)
 
         # ----------------- END TRIAL CONDITIONS -----------------
         if boom_until != 0.0 and now >= boom_until:  # Conditional branch'
             reset_balloon_visual()
             fixation.draw()  # Execute statement
+            schedule_marker("BART_FIXATION_START", block=block_name, trial=tnum)  # Pushed on the next flip
             safe_flip()  # Call safe_flip()
-            send_marker("BART_FIXATION_START", block=block_name, trial=tnum)  # Call send_marker()
             core.wait(FIXATION_BASELINE)  # Execute statement
+            schedule_marker("BART_FIXATION_END", block=block_name, trial=tnum)  # Pushed on the next flip
             safe_flip()  # Call safe_flip()
-            send_marker("BART_FIXATION_END", block=block_name, trial=tnum)  # Call send_marker()
             break  # Exit current loop
 
         if collect_until != 0.0 and now >= collect_until and boom_until == 0.0:  # Conditional branch
             fixation.draw()  # Execute statement
+            schedule_marker("BART_FIXATION_START", block=block_name, trial=tnum)  # Pushed on the next flip
             safe_flip()  # Call safe_flip()
-            send_marker("BART_FIXATION_START", block=block_name, trial=tnum)  # Call send_marker()
             core.wait(FIXATION_BASELINE)  # Execute statement
+            schedule_marker("BART_FIXATION_END", block=block_name, trial=tnum)  # Pushed on the next flip
             safe_flip()  # Call safe_flip()
-            send_marker("BART_FIXATION_END", block=block_name, trial=tnum)  # Call send_marker()
             break  # Exit current loop
 
         core.wait(0.001)  # Execute statement
@@ -2307,9 +3272,6 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             "run": RUN_LABEL,
             "task": TASK_LABEL,
             "subject_id": SUB_LABEL,
-            "name": (MANIFEST_ROW.get(MANIFEST_NAME_COL) if isinstance(MANIFEST_ROW, dict) else ""),
-            "high/low": (MANIFEST_ROW.get(MANIFEST_HILO_COL) if isinstance(MANIFEST_ROW, dict) else ""),
-            "condition": (CONDITION_LABEL if CONDITION_LABEL else (MANIFEST_ROW.get(MANIFEST_COND_COL) if isinstance(MANIFEST_ROW, dict) else "")),
             "block": block_name,
             "trial": tnum,
             "colour": balloon.fillColor,
@@ -2343,15 +3305,13 @@ def run_trial(block_name, idx, trial, n_in_block, bank, nf: NFConnector, use_fal
             "nf_color": (nf_cat if nf.connected else ""),
             "nf_green_frac": (round(nf_green_frac, 3) if isinstance(nf_green_frac, (float, int)) else ""),
             "nf_green_success": int(bool(nf_green_success)),
-            "baseline_mu": (nf.baseline_mu if nf.baseline_mu is not None else ""),
-            "baseline_sigma": (nf.baseline_sigma if nf.baseline_sigma is not None else ""),
-            "baseline_n": (nf.baseline_n if getattr(nf, "baseline_done", False) else ""),
         }
-    writer.writerow(row)  # Execute statement
+    frame_profiler.end_trial(block_name, tnum)  # Per-trial frame CSV + summary (FRAME_PROFILE only)
+    trial_writer.submit(row)  # Written + flushed on the TrialWriter thread
     rows_buffer.append(dict(row))  # Execute statement
-    f.flush()  # Execute statement
+    pump_log.flush()  # Append this trial's pump events to <stem>_pumps.bin
 
-    send_marker("BART_ITI", block=block_name, trial=tnum)  # Call send_marker()
+    send_marker("BART_ITI", block=block_name, trial=tnum, expoint=expoint)  # Trial end: expoint for both outcomes
     core.wait(ITI)  # Execute statement
     return bank, bool(nf_green_success)  # Return value from function
 
@@ -2528,16 +3488,13 @@ CONC_SEC = 30.0  # duration for Concentrated Rest baseline (seconds)
 REST_SAMPLE_HZ = 10.0  # how often to sample (upper bound); actual theta updates are governed by NF_UPDATE_INTERVAL
 
 def _rest_block_screen(title: str, body: str, allow_continue=True):  # Define function _rest_block_screen
-    title_stim = visual.TextStim(win, text=title, pos=(0, 220), height=40, color=UI_TEXT_COLOR, bold=True)  # Set title_stim
-    # Set body_stim
-    body_stim  = visual.TextStim(win, text=body,  pos=(0, 20),  height=26, color=UI_TEXT_COLOR, wrapWidth=1000, alignText="left")
-    foot_stim  = visual.TextStim(win, text=("Press SPACE to begin" if allow_continue else ""),
-                                 pos=(0, -300), height=22, color=UI_ACCENT_COLOR)  # Set pos
+    rest_title.text = title  # Execute statement
+    rest_body.text = body  # Execute statement
     while True:  # Loop while condition holds
-        title_stim.draw()  # Execute statement
-        body_stim.draw()  # Execute statement
+        rest_title.draw()  # Execute statement
+        rest_body.draw()  # Execute statement
         if allow_continue:  # Conditional branch
-            foot_stim.draw()  # Execute statement
+            rest_footer.draw()  # Execute statement
         safe_flip()  # Call safe_flip()
         ks = event.getKeys(keyList=["space","escape"])  # Set ks
         if "escape" in ks:  # Conditional branch
@@ -2567,7 +3524,7 @@ def run_rest_block(nf: NFConnector, tag: str, duration_s: float, eyes_closed: bo
 
     _rest_block_screen(title, body, allow_continue=True)  # Call _rest_block_screen()
 
-    send_marker("REST_START", tag=tag, eyes=("closed" if eyes_closed else "open"), dur=duration_s)  # Call send_marker()
+    schedule_marker("REST_START", tag=tag, eyes=("closed" if eyes_closed else "open"), dur=duration_s)  # Pushed on the first countdown flip
 
     # countdown fixation + sampling
     t0 = core.getTime()  # Set t0
@@ -2576,6 +3533,8 @@ def run_rest_block(nf: NFConnector, tag: str, duration_s: float, eyes_closed: bo
 
     theta_samples = []  # Set theta_samples
     z_samples = []  # Set z_samples
+    frames = FrameTimeLog((duration_s + 1.0) * 250)  # flip times (sized for up to 250 Hz)
+    shown = None  # countdown value currently rendered in rest_countdown
 
     while True:  # Loop while condition holds
         now = core.getTime()  # Set now
@@ -2583,12 +3542,14 @@ def run_rest_block(nf: NFConnector, tag: str, duration_s: float, eyes_closed: bo
         if t >= duration_s:  # Conditional branch
             break  # Exit current loop
 
-        # draw fixation and countdown
+        # draw fixation and countdown (text re-rendered only when the second changes)
         remaining = int(duration_s - t + 0.999)  # Set remaining
+        if remaining != shown:  # Conditional branch
+            rest_countdown.text = str(remaining)  # Execute statement
+            shown = remaining  # Set shown
         fixation.draw()  # Execute statement
-        cd = visual.TextStim(win, text=f"{remaining}", pos=(0, -140), height=28, color=UI_ACCENT_COLOR)  # Set cd
-        cd.draw()  # Execute statement
-        safe_flip()  # Call safe_flip()
+        rest_countdown.draw()  # Execute statement
+        frames.flip()  # Call safe_flip() and log the flip time
 
         # allow abort
         if event.getKeys(keyList=["escape"]):  # Conditional branch
@@ -2609,7 +3570,11 @@ def run_rest_block(nf: NFConnector, tag: str, duration_s: float, eyes_closed: bo
 
         core.wait(0.001)  # Execute statement
 
-    send_marker("REST_END", tag=tag, eyes=("closed" if eyes_closed else "open"))  # Call send_marker()
+    fstats = frames.summary()  # Set fstats
+    send_marker("REST_END", tag=tag, eyes=("closed" if eyes_closed else "open"),
+                frames=fstats["frames"], dropped=fstats["dropped"], max_ms=f"{fstats['max_ms']:.1f}")  # Call send_marker()
+    print(f"[REST {tag}] frames={fstats['frames']} dropped={fstats['dropped']} "
+          f"median={fstats['median_ms']:.2f}ms max={fstats['max_ms']:.2f}ms")  # Print debug/status message
 
 
     # Play an end-of-block chime ONLY after eyes-closed rest (EC).
@@ -2642,6 +3607,7 @@ def run_rest_block(nf: NFConnector, tag: str, duration_s: float, eyes_closed: bo
         "n": n,
         "theta_samples": theta_samples,
         "z_samples": z_samples,
+        "frames": fstats,
     }
 
 
@@ -2662,40 +3628,21 @@ def run_concentrated_rest(nf, block_code: str, duration_s: float):  # Define fun
     # Create a random 3-digit start number for the mental arithmetic prompt
     start_num = random.randint(100, 999)  # Random start value
 
-    # User-friendly instruction text
-    title = visual.TextStim(win, text="Concentrated Rest", height=44, color=UI_TEXT_COLOR, pos=(0, 200), bold=True)
-    body  = visual.TextStim(
-        win,
-        text=("""A 3-digit number will appear.
-
-Please count backwards out loud or silently by 7s (e.g., 392, 385, 378, ...).
-This is a short concentration rest.
-
-This helps us calibrate the neurofeedback baseline."""),
-        height=26,
-        color=UI_TEXT_COLOR,
-        wrapWidth=1000,
-        pos=(0, 10)
-    )
-    prompt = visual.TextStim(win, text="Press SPACE to begin", height=24, color=UI_ACCENT_COLOR, pos=(0, -260))
-
-    # Show page and wait
-    title.draw(); body.draw(); prompt.draw(); safe_flip()
+    # Show page and wait (stimuli are the persistent conc_* set)
+    conc_title.draw(); conc_body.draw(); conc_prompt.draw(); safe_flip()
     ks = event.waitKeys(keyList=["space", "escape"])  # Wait for keypress
     if "escape" in ks:
         send_marker("BART_ABORT")
         cleanup_and_exit(fh=f, send_final=False)
 
     # Countdown for timing clarity
-    send_marker("REST_START", block=block_code, kind="concentrated", dur=duration_s)
-    countdown = visual.TextStim(win, text="3", height=72, color=UI_TEXT_COLOR, pos=(0, 0), bold=True)
+    schedule_marker("REST_START", block=block_code, kind="concentrated", dur=duration_s)
     for n in ["3", "2", "1"]:
-        countdown.text = n
-        countdown.draw(); safe_flip(); core.wait(1.0)
+        conc_countdown.text = n
+        conc_countdown.draw(); safe_flip(); core.wait(1.0)
 
     # Display the number + fixation during the block
-    num_stim = visual.TextStim(win, text=str(start_num), height=72, color=UI_TEXT_COLOR, pos=(0, 40), bold=True)
-    instr    = visual.TextStim(win, text="Count backwards by 7s", height=28, color=UI_TEXT_COLOR, pos=(0, -60))
+    conc_num.text = str(start_num)
 
     # Sample theta/z during this block (same sampling method as run_rest_block)
     t0 = core.getTime()
@@ -2704,6 +3651,7 @@ This helps us calibrate the neurofeedback baseline."""),
     z_vals = []
     theta_samples = []
     z_samples = []
+    frames = FrameTimeLog((duration_s + 1.0) * 250)
 
     while core.getTime() - t0 < duration_s:
         # update NF; pull_z updates nf.last_theta and returns z
@@ -2722,12 +3670,16 @@ This helps us calibrate the neurofeedback baseline."""),
             next_sample = now + (1.0 / max(1e-6, REST_SAMPLE_HZ))
 
         # draw frame
-        num_stim.draw()
-        instr.draw()
-        safe_flip()
+        conc_num.draw()
+        conc_instr.draw()
+        frames.flip()
         core.wait(0.001)
 
-    send_marker("REST_END", block=block_code, kind="concentrated")
+    fstats = frames.summary()
+    send_marker("REST_END", block=block_code, kind="concentrated",
+                frames=fstats["frames"], dropped=fstats["dropped"], max_ms=f"{fstats['max_ms']:.1f}")
+    print(f"[REST {block_code}] frames={fstats['frames']} dropped={fstats['dropped']} "
+          f"median={fstats['median_ms']:.2f}ms max={fstats['max_ms']:.2f}ms")
 
     # Compute summary stats
     def _mean_std(arr):
@@ -2748,39 +3700,77 @@ This helps us calibrate the neurofeedback baseline."""),
         "n": n,
         "theta_samples": theta_samples,
         "z_samples": z_samples,
+        "frames": fstats,
     }
-def apply_rest_columns_to_rows(rows, rest_metrics: dict):  # Define function apply_rest_columns_to_rows
-    """Fill rest_* columns on every trial row."""  # Start/continue docstring
-    for r in rows:  # Loop over items
-        for rb in ["pre_eo","pre_ec","pre_conc","post_eo","post_ec"]:  # Loop over items
-            met = rest_metrics.get(rb, {})  # Set met
-            r[f"rest_{rb}_theta_mean"] = met.get("theta_mean", "")  # Execute statement
-            r[f"rest_{rb}_theta_std"]  = met.get("theta_std", "")  # Execute statement
-            r[f"rest_{rb}_z_mean"]     = met.get("z_mean", "")  # Execute statement
-            r[f"rest_{rb}_z_std"]      = met.get("z_std", "")  # Execute statement
-            r[f"rest_{rb}_n"]          = met.get("n", "")  # Execute statement
-    return rows  # Return value from function
-
-def rewrite_csv_from_buffer(csv_path: str, fieldnames: list, rows: list):  # Define function rewrite_csv_from_buffer
-    """Rewrite CSV entirely from rows buffer (ensures new columns are populated)."""  # Start/continue docstring
+def build_session_sidecar():  # Define function build_session_sidecar
+    """Session-constant values for <stem>_beh.json (manifest, NF baseline, rest-block summaries)."""  # Docstring
+    man = MANIFEST_ROW if isinstance(MANIFEST_ROW, dict) else {}  # Set man
+    side = {
+        "TaskName": TASK_LABEL,
+        "sub": SUB_LABEL,
+        "ses": SES_LABEL,
+        "run": RUN_LABEL,
+        "manifest": {
+            "name": man.get(MANIFEST_NAME_COL, ""),
+            "high/low": man.get(MANIFEST_HILO_COL, ""),
+            "condition": (CONDITION_LABEL if CONDITION_LABEL else man.get(MANIFEST_COND_COL, "")),
+        },
+        "nf_source": ("SHAM_NF" if SHAM_NF else ("SIM" if SIMULATE_NF else "EEG")),
+    }
+    if 'nf' in globals():  # Conditional branch
+        side["baseline"] = {
+            "mu": (nf.baseline_mu if nf.baseline_mu is not None else ""),
+            "sigma": (nf.baseline_sigma if nf.baseline_sigma is not None else ""),
+            "n": (nf.baseline_n if getattr(nf, "baseline_done", False) else ""),
+            "direction": getattr(nf, "baseline_direction", ""),
+            "method": getattr(nf, "baseline_method", ""),
+        }
+    rest = {}  # Set rest
+    for rb, met in (globals().get("rest_metrics") or {}).items():  # Loop over items
+        rest[rb] = {k: met.get(k, "") for k in REST_STATS}  # Execute statement
+        if "frames" in met:  # Conditional branch
+            rest[rb]["frames"] = met["frames"]  # Execute statement
+    side["rest"] = rest  # Execute statement
+    if 'startup' in globals():  # Conditional branch
+        side["startup"] = startup.as_dict()  # Execute statement
+    return side  # Return value from function
+
+
+def save_session_sidecar():  # Define function save_session_sidecar
+    """Rewrite <stem>_beh.json atomically with the current session constants (survives a crash)."""  # Docstring
     try:  # Begin protected block (handle errors)
-        with open(csv_path, "w", newline="") as _fh:  # Context manager (auto cleanup)
-            w = csv.DictWriter(_fh, fieldnames=fieldnames)  # Set w
-            w.writeheader()  # Execute statement
-            for r in rows:  # Loop over items
-                w.writerow({k: r.get(k, "") for k in fieldnames})  # Execute statement
+        sidecar = build_session_sidecar()  # Set sidecar
+        write_sidecar(sidecar_path(csvfile), sidecar)  # Call write_sidecar()
+        return sidecar  # Return value from function
     except Exception as e:  # Handle an error case
-        print("⚠️ Could not rewrite CSV with rest columns:", e)  # Print debug/status message
+        print("⚠️ Could not write session sidecar:", e)  # Print debug/status message
+        return {}  # Return value from function
 
 
 # ----------------------------------------------------------------------
 # MAIN SCRIPT ENTRY POINT
 # ----------------------------------------------------------------------
 
+startup.mark("output files")  # Execute statement
 nf = NFConnector()  # Set nf
+frame_profiler = FrameProfiler(os.path.join(outdir, bids_stem + "_frames.csv")) if FRAME_PROFILE else _NoFrameProfiler()  # Set frame_profiler
+nf.open_feature_log(os.path.join(outdir, bids_stem + "_nffeatures.csv"))  # only written when NF_LOCAL_THETA is on
+save_session_sidecar()  # manifest + mode on disk from the start; rewritten after each rest block / baseline
 
 # ----------------- CONNECT NF / EEG -----------------
-if REQUIRE_NF and not SIMULATE_NF:  # Conditional branch
+if SIMULATE_NF or SHAM_NF:  # Conditional branch
+    nf.try_connect()  # SIM/SHAM: no live stream needed
+else:  # Fallback branch
+    # FAST_START: use the background resolve (started before the ID prompt) if it is done within
+    # LSL_RESOLVE_WAIT_S. If it is still running, never resolve a second time here: the acquisition
+    # thread (started below) connects as soon as NF_Z appears; without that thread, wait for the job.
+    wait_s = LSL_RESOLVE_WAIT_S if (NF_ACQ_THREAD or REQUIRE_NF) else None  # Set wait_s
+    resolved = startup_jobs.result("lsl_resolve", timeout=wait_s) if FAST_START else None  # Set resolved
+    if resolved is not None:  # Conditional branch
+        nf.try_connect(resolved=resolved)  # Execute statement
+    elif not (REQUIRE_NF or startup_jobs.pending("lsl_resolve")):  # Serial startup (or the job failed)
+        nf.try_connect(attempts=10, sleep_s=0.2)  # Execute statement
+if REQUIRE_NF and not (SIMULATE_NF or SHAM_NF):  # Conditional branch
     wait_txt = visual.TextStim(
         win,
         text=f"Waiting for EEG stream '{EEG_STREAM_NAME}'...\n(Press ESC to quit)",
@@ -2792,10 +3782,18 @@ if REQUIRE_NF and not SIMULATE_NF:  # Conditional branch
         safe_flip()  # Call safe_flip()
         if event.getKeys(keyList=["escape"]):  # Conditional branch
             cleanup_and_exit(fh=f, send_final=False)  # Call cleanup_and_exit()
+        if FAST_START and startup_jobs.pending("lsl_resolve"):  # Background resolve still running: wait for it
+            core.wait(0.1)  # Execute statement
+            continue  # Keep the wait screen responsive
         nf.try_connect(attempts=1, sleep_s=0.5)  # Execute statement
         core.wait(0.5)  # Execute statement
-else:  # Fallback branch
-    nf.try_connect(attempts=10, sleep_s=0.2)  # Execute statement
+nf.start_acquisition()  # EEG/LSL mode: move inlet pulls off the frame loop
+startup.mark("nf connect")  # Execute statement
+
+end_chime = startup_jobs.result("audio")  # Set end_chime
+CHIME_OK = end_chime is not None  # Set CHIME_OK
+startup.mark("audio")  # Execute statement
+startup.report()  # Execute statement
 
 
 # ----------------- REST OVERVIEW SCREEN -----------------
@@ -2840,6 +3838,7 @@ while True:  # Loop while condition holds
     body.draw()  # Execute statement
     footer.draw()  # Execute statement
     win.flip()  # Execute statement
+    build_pending_stimuli(budget_s=0.005)  # a few lazy stimuli per frame while the participant reads
 
     keys = event.getKeys(keyList=["space", "escape"])  # Set keys
     if "escape" in keys:  # Conditional branch
@@ -2848,14 +3847,19 @@ while True:  # Loop while condition holds
         break  # Exit current loop
 
 
+build_pending_stimuli()  # anything still unbuilt, before the timed blocks start
+
 # ----------------- PRE REST (EO/EC) -----------------
 rest_metrics = {}  # Set rest_metrics
 send_marker("BART_BASELINE_START", phase="rest_calibration")  # baseline calibration begins
 rest_metrics["pre_eo"] = run_rest_block(nf, "pre_eo", REST_SEC, eyes_closed=False)  # Execute statement
+save_session_sidecar()  # Call save_session_sidecar()
 rest_metrics["pre_ec"] = run_rest_block(nf, "pre_ec", REST_SEC, eyes_closed=True)  # Execute statement
+save_session_sidecar()  # Call save_session_sidecar()
 
 # --- Concentrated Rest (baseline direction calibration) ---
 rest_metrics["pre_conc"] = run_concentrated_rest(nf, "pre_conc", CONC_SEC)  # collect concentration samples
+save_session_sidecar()  # Call save_session_sidecar()
 
 # --- Compute NF baseline from EO rest + concentration block ---
 nf.set_baseline_from_rest_epochs(
@@ -2863,6 +3867,7 @@ nf.set_baseline_from_rest_epochs(
     rest_metrics.get("pre_conc", {}).get("theta_samples", [])
 )
 send_marker("BART_BASELINE_END", phase="rest_calibration", mu=nf.baseline_mu, sigma=nf.baseline_sigma, dir=nf.baseline_direction, n=nf.baseline_n)
+save_session_sidecar()  # baseline μ/σ on disk before any trial row depends on it
 
 # ----------------- INSTRUCTIONS -----------------
 pages = instruction_pages()  # Set pages
@@ -2939,7 +3944,7 @@ for tr in main_trials:  # Loop over items
 
     if green_streak >= GREEN_STREAK_TARGET:  # Conditional branch
         total_bank += BONUS_POINTS  # Execute statement
-        send_marker(
+        schedule_marker(
             "NF_BONUS",
             block="Main",
             bonus=BONUS_POINTS,
@@ -2974,11 +3979,11 @@ if ks and ('escape' in ks):
     cleanup_and_exit(fh=f, send_final=False, total_bank=total_bank)
 # ----------------- POST REST (EO/EC) -----------------
 rest_metrics["post_eo"] = run_rest_block(nf, "post_eo", REST_SEC, eyes_closed=False)  # Execute statement
+save_session_sidecar()  # Call save_session_sidecar()
 rest_metrics["post_ec"] = run_rest_block(nf, "post_ec", REST_SEC, eyes_closed=True)  # Execute statement
+save_session_sidecar()  # Call save_session_sidecar()
 
-# Apply rest columns to all rows and rewrite CSV so rest values are present
-apply_rest_columns_to_rows(rows_buffer, rest_metrics)  # Call apply_rest_columns_to_rows()
-rewrite_csv_from_buffer(csvfile, FIELDNAMES, rows_buffer)  # Call rewrite_csv_from_buffer()
+# Rest summaries go to the <stem>_beh.json sidecar (rewritten after every block and at exit); the trial CSV is never rewritten
 
 # ----------------- END SCREEN -----------------
 end_text = visual.TextStim(
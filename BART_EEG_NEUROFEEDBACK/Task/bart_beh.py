@@ -0,0 +1,337 @@
+"""
+bart_beh.py
+
+Session sidecar (<stem>_beh.json) and wide-table compatibility export for the BART task.
+
+The task writes the trial CSV append-only with per-trial columns only. Values that are
+constant for the whole session (manifest fields, NF baseline, rest-block summaries) go to
+the JSON sidecar instead, rewritten atomically (write_sidecar) at session start, after each
+rest block and baseline, and at exit, so the file on disk is current even after a crash. widen_rows() / export_wide_csv() rebuild the original
+wide layout (manifest columns after subject_id, baseline_* and rest_* at the end) for the
+XLSX export and for older analysis code.
+
+write_parquet() writes the same tables column-typed (trials, pumps, rest NF samples) when
+pyarrow is installed; see PARQUET_TABLES.
+
+PumpEventLog records every pump as it happens (time, latency, z and NF colour at the
+press) into a preallocated structured array, appended per trial to <stem>_pumps.bin
+(read back with load_pump_events). The pumps sheet/table is built from it.
+
+Usage:
+    python bart_beh.py sub-XX_ses-YY_task-BART_run-ZZ_beh.csv [out.csv]
+"""
+
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from bart_events import BLOCK_CODES, BLOCK_NAMES
+
+REST_BLOCKS = ("pre_eo", "pre_ec", "pre_conc", "post_eo", "post_ec")
+REST_STATS = ("theta_mean", "theta_std", "z_mean", "z_std", "n")
+
+MANIFEST_COLUMNS = ("name", "high/low", "condition")
+BASELINE_COLUMNS = ("baseline_mu", "baseline_sigma", "baseline_n")
+REST_COLUMNS = tuple(f"rest_{rb}_{st}" for rb in REST_BLOCKS for st in REST_STATS)
+
+
+def sidecar_path(csv_path):
+    """<stem>_beh.csv -> <stem>_beh.json"""
+    return os.path.splitext(csv_path)[0] + ".json"
+
+
+def write_sidecar(path, sidecar):
+    """Write the sidecar atomically (temp file + rename)."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(sidecar, fh, indent=2, default=str)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def load_sidecar(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def wide_fieldnames(fieldnames):
+    """Trial CSV columns -> original wide column order."""
+    fields = [c for c in fieldnames if c not in MANIFEST_COLUMNS + BASELINE_COLUMNS + REST_COLUMNS]
+    at = fields.index("subject_id") + 1 if "subject_id" in fields else 0
+    return fields[:at] + list(MANIFEST_COLUMNS) + fields[at:] + list(BASELINE_COLUMNS) + list(REST_COLUMNS)
+
+
+def session_columns(sidecar):
+    """Constant wide columns (manifest, baseline_*, rest_*) from a sidecar dict."""
+    man = sidecar.get("manifest", {}) or {}
+    base = sidecar.get("baseline", {}) or {}
+    rest = sidecar.get("rest", {}) or {}
+    cols = {c: man.get(c, "") for c in MANIFEST_COLUMNS}
+    cols["baseline_mu"] = base.get("mu", "")
+    cols["baseline_sigma"] = base.get("sigma", "")
+    cols["baseline_n"] = base.get("n", "")
+    for rb in REST_BLOCKS:
+        met = rest.get(rb, {}) or {}
+        for st in REST_STATS:
+            cols[f"rest_{rb}_{st}"] = met.get(st, "")
+    return cols
+
+
+def widen_rows(rows, sidecar):
+    """New row dicts with the session columns added (input rows are not modified)."""
+    const = session_columns(sidecar)
+    return [{**r, **const} for r in rows]
+
+
+def export_wide_csv(csv_path, out_path=None, sidecar=None):
+    """Write the wide table for a trial CSV (+ its sidecar) and return the output path."""
+    if sidecar is None:
+        sidecar = load_sidecar(sidecar_path(csv_path))
+    if out_path is None:
+        out_path = os.path.splitext(csv_path)[0] + "_wide.csv"
+    with open(csv_path, newline="") as fh:
+        rd = csv.DictReader(fh)
+        fields = wide_fieldnames(rd.fieldnames or [])
+        rows = widen_rows(rd, sidecar)
+    with open(out_path, "w", newline="") as fh:
+        w = csv.DictWriter(fh, fieldnames=fields, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+    return out_path
+
+
+# ----------------------------------------------------------------------
+# COLUMNAR OUTPUT (Parquet)
+# NOTE: pyarrow is optional; without it write_parquet() returns False and the CSV/XLSX
+# are the only outputs. Column types: "str", "cat" (dictionary-encoded str), "int",
+# "int64", "float", "bool". Columns not listed are written as str.
+# ----------------------------------------------------------------------
+
+PARQUET_TABLES = ("trials", "pumps", "nf")
+
+TRIAL_TYPES = {
+    "sub": "cat", "ses": "cat", "run": "cat", "task": "cat", "subject_id": "cat",
+    "name": "cat", "high/low": "cat", "condition": "cat",
+    "block": "cat", "trial": "int", "colour": "cat",
+    "pump_count": "int", "exploded": "bool", "explosion_point": "int",
+    "trial_value": "int64", "loss_if_pop": "int64", "trial_earnings": "int64", "total_earnings": "int64",
+    "events": "str",
+    "trial_start_time": "float", "trial_end_time": "float", "trial_duration_sec": "float",
+    "nf_source": "cat", "z_used": "float", "nf_color": "cat",
+    "nf_green_frac": "float", "nf_green_success": "int",
+    "adjusted_pumps_trial": "int", "exploded_int": "int", "collected": "int",
+    "pump_latency_first": "float", "pump_latency_mean": "float", "pump_latency_median": "float",
+    "collect_latency_from_ready": "float", "collect_latency_from_trial_start": "float",
+    "pump_latencies_json": "str", "pump_times_json": "str",
+    "baseline_mu": "float", "baseline_sigma": "float", "baseline_n": "int",
+}
+TRIAL_TYPES.update({c: ("int" if c.endswith("_n") else "float") for c in REST_COLUMNS})
+
+PUMP_TYPES = {
+    "block": "cat", "trial": "int", "pump_number": "int",
+    "pump_latency_sec": "float", "pump_time_sec": "float",
+    "exploded_int": "int", "collected": "int", "explosion_point": "int",
+    "trial_value": "int64", "trial_earnings": "int64", "total_earnings": "int64",
+    "nf_source": "cat", "z_used": "float", "nf_color": "cat",
+    "z_at_pump": "float", "nf_color_at_pump": "cat",
+}
+PUMP_COLUMNS = tuple(PUMP_TYPES)
+
+NF_SAMPLE_TYPES = {"block": "cat", "sample": "int", "theta": "float", "z": "float"}
+
+
+def parquet_path(csv_path, table):
+    """<stem>_beh.csv -> <stem>_beh.parquet / <stem>_pumps.parquet / <stem>_nf.parquet"""
+    base = os.path.splitext(csv_path)[0]
+    if table == "trials":
+        return base + ".parquet"
+    stem = base[:-4] if base.endswith("_beh") else base
+    return f"{stem}_{table}.parquet"
+
+
+def _scalar(v):
+    """numpy values -> Python; lists/arrays -> compact "r,g,b" (3 numbers) or JSON, as in the XLSX."""
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, np.ndarray):
+        v = v.tolist()
+    if isinstance(v, (list, tuple)):
+        if len(v) == 3 and all(isinstance(x, (int, float)) for x in v):
+            return ",".join(f"{float(x):.5g}" for x in v)
+        return json.dumps(v, default=str)
+    return v
+
+
+def _cast(v, kind):
+    v = _scalar(v)
+    if v is None or (isinstance(v, str) and v == ""):
+        return None
+    try:
+        if kind in ("int", "int64"):
+            return int(float(v))
+        if kind == "float":
+            return float(v)
+        if kind == "bool":
+            return v.strip().lower() in ("1", "true") if isinstance(v, str) else bool(v)
+    except (TypeError, ValueError):
+        return None
+    return str(v)
+
+
+def arrow_table(rows, columns, types):
+    """Build a typed pyarrow.Table from row dicts (missing / '' -> null)."""
+    import pyarrow as pa
+
+    arrow_type = {"str": pa.string(), "cat": pa.string(), "int": pa.int32(),
+                  "int64": pa.int64(), "float": pa.float64(), "bool": pa.bool_()}
+    arrays = []
+    for c in columns:
+        kind = types.get(c, "str")
+        arr = pa.array([_cast(r.get(c), kind) for r in rows], type=arrow_type[kind])
+        arrays.append(arr.dictionary_encode() if kind == "cat" else arr)
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def write_parquet(path, rows, columns, types):
+    """Write rows as a typed Parquet file (atomic). Returns False when pyarrow is missing."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return False
+    tmp = path + ".tmp"
+    pq.write_table(arrow_table(rows, columns, types), tmp, compression="zstd")
+    os.replace(tmp, path)
+    return True
+
+
+def nf_sample_rows(rest_metrics):
+    """Rest-block theta/z samples (run_rest_block / run_concentrated_rest) as long-format rows."""
+    out = []
+    for rb, met in (rest_metrics or {}).items():
+        th = met.get("theta_samples", []) or []
+        zz = met.get("z_samples", []) or []
+        for i in range(max(len(th), len(zz))):
+            out.append({"block": rb, "sample": i,
+                        "theta": th[i] if i < len(th) else None,
+                        "z": zz[i] if i < len(zz) else None})
+    return out
+
+
+# ----------------------------------------------------------------------
+# PUMP EVENTS
+# NOTE: PUMP_EVENT_DTYPE is the on-disk record of <stem>_pumps.bin; only ever APPEND
+# fields / colour codes, never change existing ones.
+# ----------------------------------------------------------------------
+
+NF_COLOR_CODES = {"": 0, "low": 1, "mid": 2, "high": 3}
+NF_COLOR_NAMES = {v: k for k, v in NF_COLOR_CODES.items()}
+
+PUMP_EVENT_DTYPE = np.dtype([
+    ("block", "u1"),      # bart_events.BLOCK_CODES
+    ("trial", "i4"),
+    ("pump", "i2"),       # 1-based pump number within the trial
+    ("t", "f8"),          # press time (psychopy clock, s)
+    ("time", "f8"),       # press time since trial start (s)
+    ("latency", "f8"),    # dot-ready cue -> press (s)
+    ("z", "f4"),          # NF z (EMA) at the press; NaN when NF colour is off
+    ("color", "u1"),      # NF_COLOR_CODES of the balloon colour target at the press
+])
+
+
+class PumpEventLog:
+    """Preallocated per-session pump table; record() is O(1), flush() appends new records to disk."""
+
+    def __init__(self, capacity):
+        self.events = np.zeros(max(1, int(capacity)), dtype=PUMP_EVENT_DTYPE)
+        self.n = 0
+        self._flushed = 0
+        self._fh = None
+
+    def open(self, path):
+        try:
+            self._fh = open(path, "wb")
+        except OSError as e:
+            print("⚠️ Could not open pump event file:", e)
+            self._fh = None
+
+    def record(self, block, trial, pump, t, time, latency, z=None, color=""):
+        if self.n == len(self.events):  # only if the session runs past its planned size
+            self.events = np.concatenate([self.events, np.zeros_like(self.events)])
+        e = self.events[self.n]
+        e["block"] = BLOCK_CODES.get(block, 0)
+        e["trial"] = trial
+        e["pump"] = pump
+        e["t"] = t
+        e["time"] = time
+        e["latency"] = latency
+        e["z"] = np.nan if z is None else z
+        e["color"] = NF_COLOR_CODES.get(color, 0)
+        self.n += 1
+
+    def view(self):
+        return self.events[:self.n]
+
+    def flush(self):
+        """Append records added since the last flush (call between trials)."""
+        if self._fh is None or self._flushed == self.n:
+            return
+        try:
+            self._fh.write(self.events[self._flushed:self.n].tobytes())
+            self._fh.flush()
+            self._flushed = self.n
+        except Exception as e:
+            print("⚠️ Pump event write failed:", e)
+
+    def close(self):
+        self.flush()
+        if self._fh is not None:
+            try:
+                os.fsync(self._fh.fileno())
+                self._fh.close()
+            except Exception:
+                pass
+            self._fh = None
+
+
+def load_pump_events(path):
+    """Read <stem>_pumps.bin as a PUMP_EVENT_DTYPE array (a torn last record is dropped)."""
+    with open(path, "rb") as fh:
+        buf = fh.read()
+    n = len(buf) // PUMP_EVENT_DTYPE.itemsize
+    return np.frombuffer(buf, dtype=PUMP_EVENT_DTYPE, count=n)
+
+
+def pump_event_rows(events, trial_rows):
+    """PUMP_COLUMNS row dicts: one per recorded pump, trial-level fields joined from trial_rows."""
+    by_trial = {(str(r.get("block", "")), str(r.get("trial", ""))): r for r in trial_rows}
+    out = []
+    for e in events:
+        block = BLOCK_NAMES.get(int(e["block"]), "")
+        tr = by_trial.get((block, str(int(e["trial"]))), {})
+        row = {c: tr.get(c, "") for c in PUMP_COLUMNS}
+        z = float(e["z"])
+        row.update({
+            "block": block,
+            "trial": int(e["trial"]),
+            "pump_number": int(e["pump"]),
+            "pump_latency_sec": float(e["latency"]),
+            "pump_time_sec": float(e["time"]),
+            "z_at_pump": (round(z, 3) if np.isfinite(z) else ""),
+            "nf_color_at_pump": NF_COLOR_NAMES.get(int(e["color"]), ""),
+        })
+        out.append(row)
+    return out
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    print(export_wide_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
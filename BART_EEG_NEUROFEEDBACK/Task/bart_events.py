@@ -0,0 +1,197 @@
+"""
+bart_events.py
+
+Shared marker registry for the BART task and the EEG analysis notebooks.
+
+The task pushes every marker twice:
+- BART_Markers     : the original string stream ("CODE;timestamp=...;key=value;...")
+- BART_MarkersNum  : a float32 stream with the fixed MARKER_CHANNELS schema below,
+                     so analysis can read markers as a NumPy array (no string parsing)
+and journals it locally to <stem>_markers.jsonl (see load_marker_journal).
+
+Event / block ids are part of the data format: only ever APPEND new entries,
+never renumber existing ones.
+"""
+
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+# STREAM NAMES
+# ----------------------------------------------------------------------
+
+MARKER_STREAM_NAME = "BART_Markers"
+NUMERIC_MARKER_STREAM_NAME = "BART_MarkersNum"
+
+# ----------------------------------------------------------------------
+# EVENT REGISTRY
+# NOTE: 0 is reserved for codes that are not registered here.
+# ----------------------------------------------------------------------
+
+EVENT_CODES = {
+    "BART_TRIAL_START": 1,
+    "BART_PUMP": 2,
+    "BART_EXPLODE": 3,
+    "BART_COLLECT": 4,
+    "BART_FIXATION_START": 5,
+    "BART_FIXATION_END": 6,
+    "BART_ITI": 7,
+    "BART_ABORT": 8,
+    "BART_END": 9,
+    "NF_BONUS": 10,
+    "BART_INSTRUCTIONS_START": 20,
+    "BART_INSTRUCTIONS_PAGE": 21,
+    "BART_INSTRUCTIONS_END": 22,
+    "BART_COMPREHENSION_START": 23,
+    "BART_COMPREHENSION_RESP": 24,
+    "BART_COMPREHENSION_END": 25,
+    "BART_PRACTICE_START": 30,
+    "BART_PRACTICE_END": 31,
+    "BART_BASELINE_START": 32,
+    "BART_BASELINE_END": 33,
+    "REST_START": 40,
+    "REST_END": 41,
+    "REST_EC_CHIME": 42,
+}
+EVENT_NAMES = {v: k for k, v in EVENT_CODES.items()}
+
+# Task blocks and rest-block tags (marker field 'block', or 'tag' for EO/EC rest)
+BLOCK_CODES = {
+    "Practice": 1,
+    "Main": 2,
+    "pre_eo": 10,
+    "pre_ec": 11,
+    "pre_conc": 12,
+    "post_eo": 13,
+    "post_ec": 14,
+}
+BLOCK_NAMES = {v: k for k, v in BLOCK_CODES.items()}
+
+# ----------------------------------------------------------------------
+# NUMERIC MARKER SCHEMA (one float32 per channel, NaN = field not present)
+# ----------------------------------------------------------------------
+
+# expoint (the trial's explosion pump, -1 = no pop) is sent with BART_TRIAL_START and again at
+# the trial end (BART_EXPLODE / BART_COLLECT, BART_ITI), so each outcome row carries it.
+MARKER_CHANNELS = ("event", "block", "trial", "pump", "total", "earnings", "loss", "z", "expoint")
+MARKER_CHANNEL_INDEX = {name: i for i, name in enumerate(MARKER_CHANNELS)}
+
+
+def encode_marker(code, data, out):
+    """Fill the preallocated float32 row `out` for marker `code` with fields `data`."""
+    out.fill(np.nan)
+    out[0] = EVENT_CODES.get(code, 0)
+    blk = data.get("block", data.get("tag"))
+    if blk is not None:
+        out[1] = BLOCK_CODES.get(blk, np.nan)
+    for i in range(2, len(MARKER_CHANNELS)):
+        v = data.get(MARKER_CHANNELS[i])
+        if v is None or v == "":
+            continue
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+# ----------------------------------------------------------------------
+# ANALYSIS HELPERS (pyxdf stream dicts)
+# ----------------------------------------------------------------------
+
+def numeric_markers(stream):
+    """Return (time_stamps, {channel: float array}) for a BART_MarkersNum XDF stream."""
+    t = np.asarray(stream["time_stamps"], dtype=float)
+    x = np.asarray(stream["time_series"], dtype=float).reshape(len(t), -1)
+    return t, {name: x[:, i] for i, name in enumerate(MARKER_CHANNELS[:x.shape[1]])}
+
+
+def marker_meta(table, k):
+    """Per-event dict (block name, ints for counts, '' for missing) from a numeric_markers table."""
+    out = {}
+    for name, col in table.items():
+        v = col[k]
+        if not np.isfinite(v):
+            out[name] = ""
+        elif name == "event":
+            out[name] = EVENT_NAMES.get(int(v), "")
+        elif name == "block":
+            out[name] = BLOCK_NAMES.get(int(v), "")
+        elif name == "z":
+            out[name] = float(v)
+        else:
+            out[name] = int(v)
+    return out
+
+
+def parse_marker_string(msg):
+    """Split a BART_Markers string into (code, {key: value}) — for files without the numeric stream."""
+    if isinstance(msg, (list, tuple, np.ndarray)):
+        msg = msg[0] if len(msg) else ""
+    if isinstance(msg, bytes):
+        msg = msg.decode("utf-8", errors="ignore")
+    parts = str(msg).split(";")
+    meta = {}
+    for p in parts[1:]:
+        if "=" in p:
+            k, v = p.split("=", 1)
+            meta[k.strip()] = v.strip()
+    return parts[0].strip(), meta
+
+
+# ----------------------------------------------------------------------
+# MARKER JOURNAL (<stem>_markers.jsonl written by the task next to the _beh.csv)
+# NOTE: lsl_t is the task PC's pylsl.local_clock(); it is on the XDF time axis when
+# LabRecorder runs on the task PC (pyxdf clock sync otherwise shifts streams slightly).
+# ----------------------------------------------------------------------
+
+def load_marker_journal(path):
+    """Return (string_stream, numeric_stream) pyxdf-like dicts rebuilt from a marker journal.
+
+    Markers the task could not push to LSL (journal field "lsl_dropped") are included.
+    """
+    recs = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                recs.append(json.loads(line))
+            except ValueError:
+                continue  # torn last line after a crash
+    recs.sort(key=lambda r: r.get("seq", 0))
+
+    t = np.array([r["lsl_t"] for r in recs], dtype=float)
+    msgs = [[f"{r['code']};timestamp={r['t']};" + ";".join(f"{k}={v}" for k, v in r.get("data", {}).items())]
+            for r in recs]
+    num = np.full((len(recs), len(MARKER_CHANNELS)), np.nan, dtype=np.float32)
+    for i, r in enumerate(recs):
+        encode_marker(r["code"], r.get("data", {}), num[i])
+
+    def _stream(name, series):
+        return {"info": {"name": [name], "type": ["Markers"]}, "time_stamps": t, "time_series": series}
+
+    return _stream(MARKER_STREAM_NAME, msgs), _stream(NUMERIC_MARKER_STREAM_NAME, num)
+
+
+def find_marker_journal(xdf_path, search_dirs=()):
+    """Find the task journal matching an XDF's sub/ses/run (BIDS-like names); None if absent."""
+    name = Path(xdf_path).name
+    keys = {}
+    for k in ("sub", "ses", "run"):
+        m = re.search(k + r"-([A-Za-z0-9]+)", name)
+        if m:
+            keys[k] = m.group(1)
+    if "sub" not in keys:
+        return None
+    pattern = f"sub-{keys['sub']}_" + (f"ses-{keys['ses']}_" if "ses" in keys else "") + "*"
+    pattern += (f"run-{keys['run']}_markers.jsonl" if "run" in keys else "_markers.jsonl")
+    for d in [Path(xdf_path).parent, *map(Path, search_dirs)]:
+        hits = sorted(d.rglob(pattern)) if d.is_dir() else []
+        if hits:
+            return hits[0]
+    return None
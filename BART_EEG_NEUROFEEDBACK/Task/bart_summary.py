@@ -0,0 +1,149 @@
+"""
+bart_summary.py
+
+Vectorised BART summary metrics (NumPy group-by).
+
+One implementation for both consumers, so they always agree:
+- the task's XLSX 'summary' sheet (BART_Task.write_xlsx, grouped by block)
+- Analysis/Behavior/BART_XLSX_Analysis.ipynb (grouped by session)
+
+Input is a list of trial-row dicts (task) or anything indexable by column name
+(pandas DataFrame, dict of arrays). Missing / '' / non-numeric values are NaN and
+skipped by every metric.
+"""
+
+import numpy as np
+
+# Original summary-sheet columns first; later additions are appended
+SUMMARY_COLUMNS = (
+    "n_trials",
+    "explosion_frequency",
+    "mean_adjusted_pumps",
+    "mean_pump_latency",
+    "median_pump_latency",
+    "final_total_earnings",
+    "pump_latency_p25",
+    "pump_latency_p75",
+    "mean_nf_green_frac",
+    "nf_green_success_rate",
+)
+
+# Quantiles of the per-trial median pump latency → median / p25 / p75 columns
+LATENCY_QUANTILES = (0.5, 0.25, 0.75)
+
+
+def _values(data, name):
+    """Column `name` as a 1-D object array (None where absent)."""
+    if isinstance(data, (list, tuple)):
+        return np.array([r.get(name) for r in data], dtype=object)
+    try:
+        return np.asarray(data[name], dtype=object)
+    except (KeyError, IndexError):
+        return np.full(len(data), None, dtype=object)
+
+
+def as_float(values):
+    """Object/str/number array → float64 (None, '' and unparsable values → NaN)."""
+    arr = np.asarray(values, dtype=object)
+    arr = np.where(np.equal(arr, None) | np.equal(arr, ""), np.nan, arr)
+    try:
+        return arr.astype(float)
+    except (TypeError, ValueError):
+        out = np.full(len(arr), np.nan)
+        for i, v in enumerate(arr):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+def group_index(data, by):
+    """Group id per row (groups numbered in order of first appearance) and each group's first row."""
+    codes = [np.unique(_values(data, k).astype(str), return_inverse=True)[1].ravel() for k in by]
+    _, first, inv = np.unique(np.stack(codes, axis=1), axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inv.ravel()], first[order]
+
+
+def group_mean(g, ng, x):
+    ok = np.isfinite(x)
+    n = np.bincount(g[ok], minlength=ng)
+    s = np.bincount(g[ok], weights=x[ok], minlength=ng)
+    return np.where(n > 0, s / np.maximum(n, 1), np.nan)
+
+
+def group_quantiles(g, ng, x, qs):
+    """(len(qs), ng) array of linear-interpolated quantiles (as np.percentile) per group."""
+    ok = np.isfinite(x)
+    g, x = g[ok], x[ok]
+    xs = x[np.lexsort((x, g))]
+    n = np.bincount(g, minlength=ng)
+    start = np.cumsum(n) - n
+    has = n > 0
+    out = np.full((len(qs), ng), np.nan)
+    for i, q in enumerate(qs):
+        pos = q * (n[has] - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.ceil(pos).astype(int)
+        a = xs[start[has] + lo]
+        b = xs[start[has] + hi]
+        out[i, has] = a + (b - a) * (pos - lo)
+    return out
+
+
+def group_last(g, ng, x):
+    last = np.full(ng, -1)
+    np.maximum.at(last, g, np.arange(len(g)))
+    return x[last]
+
+
+def summarize(data, by=("block",)):
+    """Summary metrics per group of `by` columns → dict of columns (keys first, then SUMMARY_COLUMNS)."""
+    n_rows = len(data)
+    out = {k: [] for k in by}
+    out.update({c: np.array([]) for c in SUMMARY_COLUMNS})
+    if n_rows == 0:
+        return out
+
+    g, first = group_index(data, by)
+    ng = len(first)
+    for k in by:
+        out[k] = list(_values(data, k)[first])
+
+    col = {c: as_float(_values(data, c)) for c in (
+        "exploded_int", "adjusted_pumps_trial", "pump_latency_mean", "pump_latency_median",
+        "total_earnings", "nf_green_frac", "nf_green_success")}
+    lat_q = group_quantiles(g, ng, col["pump_latency_median"], LATENCY_QUANTILES)
+
+    out["n_trials"] = np.bincount(g, minlength=ng)
+    out["explosion_frequency"] = group_mean(g, ng, col["exploded_int"])
+    out["mean_adjusted_pumps"] = group_mean(g, ng, col["adjusted_pumps_trial"])
+    out["mean_pump_latency"] = group_mean(g, ng, col["pump_latency_mean"])
+    out["median_pump_latency"] = lat_q[0]
+    out["final_total_earnings"] = group_last(g, ng, col["total_earnings"])
+    out["pump_latency_p25"] = lat_q[1]
+    out["pump_latency_p75"] = lat_q[2]
+    out["mean_nf_green_frac"] = group_mean(g, ng, col["nf_green_frac"])
+    out["nf_green_success_rate"] = group_mean(g, ng, col["nf_green_success"])
+    return out
+
+
+def summary_rows(summary, missing=""):
+    """summarize() output → list of row dicts with plain Python values (NaN → `missing`)."""
+    keys = list(summary)
+    n = len(summary["n_trials"])
+    rows = []
+    for i in range(n):
+        r = {}
+        for k in keys:
+            v = summary[k][i]
+            if isinstance(v, (np.integer,)):
+                v = int(v)
+            elif isinstance(v, (float, np.floating)):
+                v = float(v) if np.isfinite(v) else missing
+            r[k] = v
+        rows.append(r)
+    return rows
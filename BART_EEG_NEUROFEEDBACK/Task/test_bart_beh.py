@@ -0,0 +1,50 @@
+"""
+test_bart_beh.py
+
+Typed Parquet tables from trial rows as BART_Task.py builds them (needs pyarrow).
+
+Run from Task/:  python -m pytest -q test_bart_beh.py
+"""
+
+import numpy as np
+import pytest
+
+from bart_beh import TRIAL_TYPES, arrow_table, parquet_path, widen_rows, wide_fieldnames, write_parquet
+
+pa = pytest.importorskip("pyarrow")
+
+FIELDS = ["sub", "block", "trial", "colour", "pump_count", "exploded", "explosion_point",
+          "z_used", "nf_color", "pump_latency_mean", "pump_latencies_json"]
+
+
+def _trial_row(trial, colour, **kw):
+    row = {"sub": "01", "block": "Main", "trial": trial,
+           "colour": colour,  # balloon.fillColor: PsychoPy returns an ndarray
+           "pump_count": np.int64(7), "exploded": False, "explosion_point": -1,
+           "z_used": "", "nf_color": "", "pump_latency_mean": np.float64(0.41),
+           "pump_latencies_json": "[0.4, 0.42]"}
+    row.update(kw)
+    return row
+
+
+def test_arrow_table_with_array_colour():
+    rows = [_trial_row(1, np.array([0.6, 0.6, -0.48])),
+            _trial_row(2, [1, 1, 0], exploded=True, explosion_point=np.int32(7), z_used=0.25),
+            _trial_row(3, "")]
+    t = arrow_table(rows, FIELDS, TRIAL_TYPES).to_pydict()
+    assert t["colour"] == ["0.6,0.6,-0.48", "1,1,0", None]
+    assert t["pump_count"] == [7, 7, 7]
+    assert t["exploded"] == [False, True, False]
+    assert t["explosion_point"] == [-1, 7, -1]
+    assert t["z_used"] == [None, 0.25, None]
+    assert t["pump_latency_mean"] == [0.41, 0.41, 0.41]
+
+
+def test_write_parquet_trials(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    rows = widen_rows([_trial_row(1, np.array([0.6, 0.6, -0.48]))], {"baseline": {"mu": 1.5, "n": 30}})
+    path = parquet_path(str(tmp_path / "sub-01_task-BART_beh.csv"), "trials")
+    assert write_parquet(path, rows, wide_fieldnames(FIELDS), TRIAL_TYPES)
+    t = pq.read_table(path)
+    assert t.column("colour").to_pylist() == ["0.6,0.6,-0.48"]
+    assert t.schema.field("trial").type == pa.int32()
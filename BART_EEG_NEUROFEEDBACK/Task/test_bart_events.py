@@ -0,0 +1,76 @@
+"""
+test_bart_events.py
+
+Marker journal round-trip: lines as BART_Task.py's MarkerJournal writes them,
+read back with load_marker_journal and numeric_markers.
+
+Run from Task/:  python -m pytest -q test_bart_events.py
+"""
+
+import json
+
+import numpy as np
+
+from bart_events import EVENT_CODES, load_marker_journal, marker_meta, numeric_markers, parse_marker_string
+
+TRIAL = [
+    ("BART_TRIAL_START", {"block": "Main", "trial": 3, "expoint": 12, "nf": "EEG", "z": 0.412}),
+    ("BART_PUMP", {"block": "Main", "trial": 3, "pump": 1, "key": "space", "press_t": 10.01}),
+    ("BART_EXPLODE", {"block": "Main", "trial": 3, "pump": 12, "loss": 60, "total": 140, "expoint": 12}),
+    ("BART_ITI", {"block": "Main", "trial": 3, "expoint": 12}),
+    ("BART_TRIAL_START", {"block": "Main", "trial": 4, "expoint": -1, "nf": "NONE", "z": ""}),
+    ("BART_COLLECT", {"block": "Main", "trial": 4, "pump": 5, "earnings": 25, "total": 165,
+                      "latency_from_start": 3.2, "latency_from_ready": 0.4, "expoint": -1}),
+    ("BART_ITI", {"block": "Main", "trial": 4, "expoint": -1}),
+]
+
+
+def _write_journal(path, recs):
+    # Shuffled order and a torn last line, as after a crash mid-write
+    lines = [json.dumps({"seq": i, "code": c, "t": 10.0 + i, "lsl_t": 1000.0 + i, "data": d},
+                        separators=(",", ":"))
+             for i, (c, d) in enumerate(recs)]
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(lines[::-1]) + "\n" + lines[0][:17])
+
+
+def test_journal_round_trip(tmp_path):
+    path = tmp_path / "sub-01_ses-1_task-bart_run-1_markers.jsonl"
+    _write_journal(path, TRIAL)
+    strings, num = load_marker_journal(path)
+
+    t, table = numeric_markers(num)
+    np.testing.assert_array_equal(t, 1000.0 + np.arange(len(TRIAL)))
+    np.testing.assert_array_equal(table["event"], [EVENT_CODES[c] for c, _ in TRIAL])
+    np.testing.assert_array_equal(table["trial"], [3, 3, 3, 3, 4, 4, 4])
+    assert np.isnan(table["pump"][0]) and table["pump"][2] == 12
+    assert table["loss"][2] == 60 and table["earnings"][5] == 25
+    assert np.isclose(table["z"][0], 0.412) and np.isnan(table["z"][4])
+
+    for k, (code, data) in enumerate(TRIAL):
+        s_code, s_meta = parse_marker_string(strings["time_series"][k])
+        assert s_code == code
+        assert s_meta["trial"] == str(data["trial"])
+        assert marker_meta(table, k)["block"] == "Main"
+
+
+def test_journal_fills_expoint_at_explode_and_trial_end(tmp_path):
+    path = tmp_path / "sub-01_markers.jsonl"
+    _write_journal(path, TRIAL)
+    _, table = numeric_markers(load_marker_journal(path)[1])
+
+    ends = [k for k, (c, _) in enumerate(TRIAL) if c in ("BART_EXPLODE", "BART_COLLECT", "BART_ITI")]
+    np.testing.assert_array_equal(table["expoint"][ends], [12, 12, -1, -1])
+    assert marker_meta(table, 2)["expoint"] == 12
+    assert np.isnan(table["expoint"][1])  # pumps do not carry it
+
+
+def test_journal_keeps_markers_dropped_from_lsl(tmp_path):
+    path = tmp_path / "sub-01_markers.jsonl"
+    recs = [{"seq": 0, "code": "BART_PUMP", "t": 1.0, "lsl_t": 101.0, "data": {"trial": 1, "pump": 1}},
+            {"seq": 1, "code": "BART_PUMP", "t": 1.2, "lsl_t": 101.2, "data": {"trial": 1, "pump": 2},
+             "lsl_dropped": True}]
+    path.write_text("\n".join(json.dumps(r) for r in recs) + "\n", encoding="utf-8")
+    t, table = numeric_markers(load_marker_journal(path)[1])
+    np.testing.assert_array_equal(t, [101.0, 101.2])
+    np.testing.assert_array_equal(table["pump"], [1, 2])
@@ -0,0 +1,153 @@
+"""
+test_nf_spectral.py
+
+Band-power engines in nf_spectral.py vs. the plain FFT path:
+mean(|rfft(x - mean(x))|**2) over each band's rfft bins, per channel
+(TaperedBandPower: per segment / taper, vs. scipy.signal.welch and explicit tapered FFTs).
+
+Run from Task/:  python -m pytest -q test_nf_spectral.py
+"""
+
+import sys
+
+import numpy as np
+import pytest
+
+from nf_spectral import RingBuffer, BandPowerDFT, SlidingDFT, TaperedBandPower, _dpss_tapers
+
+N = 1024
+FS = 512.0
+BANDS = ((4.0, 8.0), (8.0, 13.0), (13.0, 30.0))
+N_CH = 3
+
+
+def rfft_band_power(window, fs=FS, bands=BANDS):
+    """Reference (n_bands, n_channels) band power of a time-ordered (n, n_channels) window."""
+    x = window - window.mean(axis=0)
+    psd = np.abs(np.fft.rfft(x, axis=0)) ** 2
+    freqs = np.fft.rfftfreq(len(window), 1.0 / fs)
+    return np.array([psd[(freqs >= lo) & (freqs <= hi)].mean(axis=0) for lo, hi in bands])
+
+
+def _feed(engine, ring, chunks, rng):
+    """Push random chunks; yield (band power, reference) after each one."""
+    for m in chunks:
+        got = engine.update(ring, rng.standard_normal((m, N_CH))).copy()
+        yield got, rfft_band_power(ring.window())
+
+
+def test_ring_buffer_window_is_time_ordered():
+    rng = np.random.default_rng(1)
+    ring = RingBuffer(N, N_CH)
+    data = rng.standard_normal((5 * N + 17, N_CH))
+    pos = 0
+    for m in (1, 7, N - 3, 2 * N, 300, 1, N // 2):
+        ring.push_block(data[pos:pos + m])
+        pos += m
+        ref = data[max(0, pos - N):pos]
+        np.testing.assert_array_equal(ring.ordered(), ref)
+    np.testing.assert_array_equal(ring.window(), data[pos - N:pos])
+
+
+def test_band_power_dft_matches_rfft():
+    rng = np.random.default_rng(2)
+    ring = RingBuffer(N, N_CH)
+    engine = BandPowerDFT(N, FS, BANDS, N_CH)
+    for got, ref in _feed(engine, ring, (N, 64, 1, 300, 3 * N), rng):
+        np.testing.assert_allclose(got, ref, rtol=1e-9)
+
+
+def test_sliding_dft_matches_rfft_over_windows():
+    rng = np.random.default_rng(3)
+    ring = RingBuffer(N, N_CH)
+    engine = SlidingDFT(N, FS, BANDS, N_CH)
+    # first chunk fills the window (resync); then incremental chunks of assorted sizes,
+    # one larger than the window (resync path) and several that cross the resync boundary
+    chunks = (N, 7, 64, 1, 300, N // 2, 3 * N, 51, 51, 51, N - 1, 2)
+    for got, ref in _feed(engine, ring, chunks, rng):
+        np.testing.assert_allclose(got, ref, rtol=1e-6, atol=1e-12)
+
+
+def test_sliding_dft_stays_exact_after_twiddle_drift_resync():
+    rng = np.random.default_rng(4)
+    ring = RingBuffer(N, N_CH)
+    engine = SlidingDFT(N, FS, BANDS, N_CH)
+    engine.update(ring, rng.standard_normal((N, N_CH)))
+    # many one-sample and small updates: twiddle round-off accumulates between resyncs,
+    # and the periodic re-projection (every N samples) must keep the error bounded
+    worst = 0.0
+    resyncs = 0
+    for i in range(20 * N // 13):
+        m = 1 if i % 3 else 13
+        before = engine._since_sync
+        got, ref = next(_feed(engine, ring, (m,), rng))
+        if engine._since_sync < before:
+            resyncs += 1
+        worst = max(worst, float(np.max(np.abs(got - ref) / np.abs(ref))))
+    assert resyncs >= 5
+    assert worst < 1e-6
+
+    # an explicit resync from the ring reproduces the reference exactly
+    engine.resync(ring.window())
+    got, ref = next(_feed(engine, ring, (5,), rng))
+    np.testing.assert_allclose(got, ref, rtol=1e-9)
+
+
+def tapered_band_power(window, tapers, fs=FS, bands=BANDS):
+    """Reference multitaper band power: mean over tapers of N * |rfft(w * (x - mean(x)))|**2 / sum(w**2)."""
+    n = len(window)
+    x = window - window.mean(axis=0)
+    psd = np.mean([n * np.abs(np.fft.rfft(w[:, None] * x, axis=0)) ** 2 / (w ** 2).sum() for w in tapers], axis=0)
+    freqs = np.fft.rfftfreq(n, 1.0 / fs)
+    return np.array([psd[(freqs >= lo) & (freqs <= hi)].mean(axis=0) for lo, hi in bands])
+
+
+@pytest.mark.parametrize("seg_s, overlap", [(1.0, 0.5), (0.5, 0.75)])
+def test_welch_band_power_matches_scipy(seg_s, overlap):
+    signal = pytest.importorskip("scipy.signal")
+    rng = np.random.default_rng(5)
+    engine = TaperedBandPower(N, FS, BANDS, N_CH, mode="welch", welch_seg_s=seg_s, welch_overlap=overlap)
+    seg = int(round(seg_s * FS))
+    for _ in range(3):
+        window = rng.standard_normal((N, N_CH))
+        freqs, psd = signal.welch(window, FS, window=np.hanning(seg), nperseg=seg,
+                                  noverlap=seg - int(round(seg * (1.0 - overlap))),
+                                  detrend="constant", scaling="density", axis=0)
+        # one-sided density -> the engine's N * |X|**2 / sum(w**2) scale
+        ref = np.array([psd[(freqs >= lo) & (freqs <= hi)].mean(axis=0) for lo, hi in BANDS]) * N * FS / 2.0
+        np.testing.assert_allclose(engine.power(window), ref, rtol=1e-9)
+
+
+def test_multitaper_band_power_matches_dpss_fft():
+    windows = pytest.importorskip("scipy.signal.windows")
+    rng = np.random.default_rng(6)
+    engine = TaperedBandPower(N, FS, BANDS, N_CH, mode="multitaper", mt_nw=3.0, mt_tapers=5)
+    tapers = windows.dpss(N, 3.0, Kmax=5)
+    for _ in range(3):
+        window = rng.standard_normal((N, N_CH)) + 5.0  # offset: removed by the per-taper detrend
+        np.testing.assert_allclose(engine.power(window), tapered_band_power(window, tapers), rtol=1e-9)
+
+
+def test_multitaper_sine_taper_fallback_without_scipy(monkeypatch):
+    monkeypatch.setitem(sys.modules, "scipy.signal.windows", None)  # import fails -> sine tapers
+    tapers = _dpss_tapers(N, 2.0, 3)
+    idx = np.arange(1, N + 1)
+    sine = np.array([np.sin(np.pi * j * idx / (N + 1.0)) for j in (1, 2, 3)])
+    np.testing.assert_allclose(tapers, sine / np.linalg.norm(sine, axis=1, keepdims=True), atol=1e-12)
+    np.testing.assert_allclose(tapers @ tapers.T, np.eye(3), atol=1e-12)
+
+    rng = np.random.default_rng(7)
+    engine = TaperedBandPower(N, FS, BANDS, N_CH, mode="multitaper", mt_nw=2.0)
+    window = rng.standard_normal((N, N_CH))
+    np.testing.assert_allclose(engine.power(window), tapered_band_power(window, tapers), rtol=1e-9)
+
+
+def test_tapered_white_noise_level_matches_rectangular():
+    # N / sum(w**2) scaling: the same white-noise power as BandPowerDFT, so baselines stay comparable
+    rng = np.random.default_rng(8)
+    engines = [BandPowerDFT(N, FS, BANDS, 1),
+               TaperedBandPower(N, FS, BANDS, 1, mode="welch"),
+               TaperedBandPower(N, FS, BANDS, 1, mode="multitaper")]
+    means = np.mean([[e.power(w)[:, 0].copy() for e in engines]
+                     for w in rng.standard_normal((400, N, 1))], axis=0)
+    np.testing.assert_allclose(means[1:], np.broadcast_to(means[0], means[1:].shape), rtol=0.05)